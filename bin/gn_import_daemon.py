@@ -0,0 +1 @@
+../import_parser/gn_daemon.py
\ No newline at end of file
@@ -0,0 +1,341 @@
+import os
+import abc
+import csv
+import json
+import time
+import datetime
+
+import click
+
+# Define default OS Environment variables for programs embedding the parser
+app_dir = os.path.realpath(f"{os.path.dirname(os.path.abspath(__file__))}/../")
+os.environ.setdefault("IMPORT_PARSER.PATHES.ROOT", os.path.realpath(f"{app_dir}/../"))
+os.environ.setdefault(
+    "IMPORT_PARSER.PATHES.SHARED.CONFIG", os.path.realpath(f"{app_dir}/../shared/config/")
+)
+os.environ.setdefault("IMPORT_PARSER.PATHES.APP", app_dir)
+os.environ.setdefault("IMPORT_PARSER.PATHES.APP.CONFIG", os.path.realpath(f"{app_dir}/config/"))
+
+from helpers.config import Config
+from helpers.helpers import print_error
+from gn2.parser import (
+    remove_headers,
+    add_headers,
+    remove_columns,
+    add_columns,
+    insert_values_to_columns,
+    force_protected_char,
+)
+
+
+class RowsCounter:
+    """Stand-in for a CSV reader with the number of the current row, used in reports."""
+
+    def __init__(self, fieldnames):
+        self.fieldnames = fieldnames
+        self.line_num = 0
+
+
+class Engine(abc.ABC):
+    """
+    Core of the parsers: actions config, lookups, stages applied to each row and reports.
+
+    Plugins (GeoNature, TaxHub) subclass it and register:
+    - actions_types: import types abbreviations with their actions config section,
+    - lookups_names: reference tables needed by each import type, loaded by
+      load_lookup() (get_all_<name>() method of the database by default),
+    - stages: method transforming rows of each import type, after columns actions.
+    A stage is called with the row, the reader (used for line numbers in reports) and
+    the list of reasons to remove the row, and returns the list of rows to write, which
+    are then checked by check_rows().
+
+    Rows are dicts of strings, like the ones of csv.DictReader. Actions can be an
+    actions config file path or a dict of actions parameters. Lookups given to the
+    constructor are not loaded from the database.
+    """
+
+    actions_types = {}
+    lookups_names = {}
+    stages = {}
+
+    def __init__(self, import_type, actions=None, lookups=None):
+        self.import_type = import_type
+        self.lookups = {} if lookups is None else lookups
+        self.fieldnames = None
+        self.start_time = datetime.datetime.now()
+        self.rows_number = 0
+        self.removed_rows_number = 0
+        self.written_rows_number = 0
+        self.lookups_durations = {}
+
+        set_actions_type(import_type, self.actions_types)
+        if actions is None:
+            actions = os.path.join(
+                os.environ["IMPORT_PARSER.PATHES.APP.CONFIG"], "actions.default.ini"
+            )
+        if isinstance(actions, dict):
+            load_actions_parameters(actions)
+        else:
+            load_actions_config_file(actions)
+        self.reports = self.build_reports()
+
+    def build_reports(self):
+        return {
+            "lines_removed_total": 0,
+            "fields_checked": False,
+            "malformed_lines": [],
+        }
+
+    def get_needed_lookups(self):
+        needed = self.lookups_names.get(self.import_type, [])
+        return [name for name in needed if name not in self.lookups]
+
+    @abc.abstractmethod
+    def connect_database(self):
+        """Return a connected database object of the plugin."""
+
+    def load_lookup(self, db, name):
+        return getattr(db, f"get_all_{name}")()
+
+    def load_lookups(self, db=None):
+        """Load from the database the lookups needed by the import type and still missing."""
+        needed = self.get_needed_lookups()
+        if not needed:
+            return self.lookups
+
+        db_owner = db is None
+        if db_owner:
+            db = self.connect_database()
+        for name in needed:
+            self.set_lookup(name, self.load_lookup, db, name)
+        if db_owner:
+            db.close()
+        return self.lookups
+
+    def set_lookup(self, name, load, *args):
+        """Set the lookup returned by load(*args) and record its loading duration."""
+        start_time = time.monotonic()
+        self.lookups[name] = load(*args)
+        self.lookups_durations[name] = time.monotonic() - start_time
+        return self.lookups[name]
+
+    def set_fieldnames(self, fieldnames):
+        """Prepare the transformation of rows with these fieldnames and return destination ones."""
+        self.load_lookups()
+        self.source_fieldnames = fieldnames
+        self.fieldnames = add_headers(remove_headers(fieldnames))
+        self.stage = self.stages.get(self.import_type)
+        return self.fieldnames
+
+    def prepare_row(self, row, reader):
+        """Apply columns actions of the actions config file to a row."""
+        # Remove useless columns
+        row = remove_columns(row, reader)
+
+        # Add new columns if necessary
+        row = add_columns(row)
+
+        # Insert value in colums
+        row = insert_values_to_columns(row)
+
+        # Maintain protected char
+        row = force_protected_char(row)
+        return row
+
+    def transform(self, row, reader):
+        """
+        Transform a row read by reader.
+
+        Return the list of rows to write and the list of reasons to remove them (empty if
+        rows must be written).
+        """
+        reasons = []
+        row = self.prepare_row(row, reader)
+        if self.stage is not None:
+            rows = self.stage(self, row, reader, reasons)
+        else:
+            rows = [row]
+        if not reasons:
+            self.check_rows(rows, reader, reasons)
+
+        self.rows_number += 1
+        if reasons:
+            self.removed_rows_number += 1
+        else:
+            self.written_rows_number += len(rows)
+        return (rows, reasons)
+
+    def check_rows(self, rows, reader, reasons):
+        """Check the rows to write and add the reasons to remove them (no checks by default)."""
+
+    def run(self, reader, writer, on_removed=None, keep_original=False, progress=None):
+        """
+        Transform all rows of reader and write them with writer.
+
+        on_removed(rows, reasons, original_row) is called for each removed row, with a copy
+        of the row as read if keep_original is True. Progress is updated by batch of rows.
+        """
+        original_row = None
+        for row in reader:
+            if keep_original:
+                original_row = dict(row)
+
+            (rows, reasons) = self.transform(row, reader)
+
+            # Write in destination file
+            if not reasons:
+                for new_row in rows:
+                    writer.writerow(new_row)
+            elif on_removed is not None:
+                on_removed(rows, reasons, original_row)
+
+            # Update progress only once per batch of rows
+            if progress is not None:
+                progress.rows += 1
+                if progress.rows >= progress.next_update:
+                    progress.update()
+
+    def process(self, rows, fieldnames=None):
+        """
+        Yield transformed rows of an iterable of rows, removed ones are only reported.
+
+        Without fieldnames, the keys of the first row are used. Reports are updated
+        while rows are consumed.
+        """
+        rows = iter(rows)
+        if fieldnames is None:
+            first_row = next(rows, None)
+            if first_row is None:
+                return
+            fieldnames = list(first_row.keys())
+            rows = _chain_first(first_row, rows)
+        if self.fieldnames is None:
+            self.set_fieldnames(fieldnames)
+
+        counter = RowsCounter(self.source_fieldnames)
+        for row in rows:
+            counter.line_num += 1
+            (new_rows, reasons) = self.transform(dict(row), counter)
+            if not reasons:
+                yield from new_rows
+
+    def render_report(self, elapsed_time=None):
+        """Render the report of the rows transformed, or None if the type has no template."""
+        if elapsed_time is None:
+            elapsed_time = str(datetime.datetime.now() - self.start_time)
+        return render_report(self.reports, elapsed_time)
+
+
+def _chain_first(first_row, rows):
+    yield first_row
+    yield from rows
+
+
+def register_dialects():
+    csv.register_dialect(
+        "ssv",
+        delimiter=";",
+        quotechar='"',
+        doublequote=True,
+        quoting=csv.QUOTE_ALL,
+        lineterminator="\r\n",
+    )
+    csv.register_dialect(
+        "ssv-minimal",
+        delimiter=";",
+        quotechar='"',
+        doublequote=True,
+        quoting=csv.QUOTE_MINIMAL,
+        lineterminator="\n",
+    )
+    csv.register_dialect(
+        "tsv",
+        delimiter="\t",
+        quotechar='"',
+        doublequote=True,
+        quoting=csv.QUOTE_MINIMAL,
+        lineterminator="\n",
+    )
+
+
+def get_dialects():
+    reader_dialect = Config.get("csv.reader.dialect") if Config.has("csv.reader.dialect") else "tsv"
+    writer_dialect = Config.get("csv.writer.dialect") if Config.has("csv.writer.dialect") else "tsv"
+    return (reader_dialect, writer_dialect)
+
+
+def print_actions_parameters():
+    reader_dialect, writer_dialect = get_dialects()
+    click.echo("Remove columns ? " + str(Config.get("actions.remove_columns")))
+    click.echo("Columns to remove: " + ", ".join(Config.get("actions.remove_columns.params")))
+    click.echo("Add columns ? " + str(Config.get("actions.add_columns")))
+    click.echo(
+        "Columns to add: "
+        + json.dumps(
+            Config.get("actions.add_columns.params"), indent=4, sort_keys=True, default=str
+        )
+    )
+    click.echo("Set columns values ? " + str(Config.get("actions.set_values")))
+    click.echo(
+        "Columns to set values: "
+        + json.dumps(Config.get("actions.set_values.params"), indent=4, sort_keys=True, default=str)
+    )
+    click.echo(f"CSV Reader dialect: {reader_dialect}")
+    click.echo(f"CSV Writer dialect: {writer_dialect}")
+
+
+def render_report(reports, elapsed_time):
+    # Jinja is only imported when a report is rendered
+    from jinja2 import Environment, FileSystemLoader
+
+    app_path = os.environ["IMPORT_PARSER.PATHES.APP"]
+    tpl_path = f"{app_path}/import_parser/templates"
+    action_type = Config.get("actions.type").lower()
+    tpl_file = f"reports/{action_type}.txt.j2"
+    if not os.path.exists(f"{tpl_path}/{tpl_file}"):
+        return None
+
+    file_loader = FileSystemLoader(searchpath=tpl_path)
+    env = Environment(loader=file_loader)
+    template = env.get_template(tpl_file)
+    return template.render(reports=reports, elapsed_time=elapsed_time)
+
+
+def save_report(report_output, report_dir):
+    if not os.path.exists(report_dir):
+        os.makedirs(report_dir)
+    current_date = datetime.date.today().isoformat()
+    action_type = Config.get("actions.type").lower()
+    report_path = f"{report_dir}/{current_date}_{action_type}.report.txt"
+    with open(report_path, "w") as fh:
+        fh.write(report_output)
+
+
+def set_actions_type(abbr_type, types):
+    if abbr_type in types:
+        Config.setParameter("actions.type", types[abbr_type])
+    else:
+        print_error(f'Type "{abbr_type}" is not implemented !')
+        exit(1)
+
+
+def load_actions_config_file(actions_config_file):
+    if actions_config_file != "" and os.path.exists(actions_config_file):
+        print(f"Actions config file: {actions_config_file}")
+        Config.load(actions_config_file)
+        define_current_actions()
+    else:
+        print_error(f'Actions config file "${actions_config_file}" not exists !')
+
+
+def load_actions_parameters(parameters):
+    # Values are stored as strings, like in actions config files
+    for key, value in parameters.items():
+        Config.setParameter(key, value if isinstance(value, str) else repr(value))
+
+
+def define_current_actions():
+    actions_type = Config.get("actions.type")
+    parameters = Config.getSection(actions_type)
+    for key, value in parameters.items():
+        Config.setParameter(key, value)
@@ -0,0 +1,390 @@
+import click
+
+from engine import Engine
+from helpers.config import Config
+from helpers.helpers import get_cache_file_path, print_error
+from helpers.ewkb import GeometriesChecker
+from helpers.pgbinary import get_columns_types, TypedValuesChecker
+from helpers.spatial import AreasIndex
+from gn2.parser import (
+    get_passthrough_fieldnames,
+    PassthroughColumns,
+    remove_columns,
+    add_columns,
+    insert_values_to_columns,
+    force_protected_char,
+    add_uuid_obs,
+    add_uuid_cor_counting_occtax,
+    replace_empty_value,
+    check_duplicates,
+    set_last_action,
+    check_geometries,
+    check_typed_values,
+    attach_area,
+    check_sciname_code,
+    check_dates,
+    check_date_max_greater_than_min,
+    check_date_min_in_future,
+    check_date_max_in_future,
+    fix_altitude_min,
+    fix_altitude_max,
+    fix_negative_altitudes,
+    fix_inverted_altitudes,
+    fix_altitudes_errors,
+    fix_depth_min,
+    fix_depth_max,
+    replace_code_dataset,
+    replace_code_module,
+    replace_code_source,
+    NomenclaturesTranslator,
+    replace_code_digitiser,
+    replace_code_area,
+    replace_code_organism,
+    set_default_description,
+    set_default_nomenclature_values,
+    replace_code_acquisition_framework,
+)
+
+ACTIONS_TYPES = {
+    "af": "ACQUISITION_FRAMEWORK",
+    "d": "DATASET",
+    "o": "ORGANISM",
+    "s": "SYNTHESE",
+    "so": "SOURCE",
+    "u": "USER",
+    "tr": "TAXREF_RANK",
+    "t": "TAXREF",
+    "oc": "OCCTAX",
+    "v": "VALIDATION",
+}
+# Lookups (reference tables of the database) needed by each import type
+LOOKUPS = {
+    "s": ["datasets", "modules", "sources", "nomenclatures", "scinames_codes", "users", "areas"],
+    "oc": ["datasets", "modules", "sources", "nomenclatures", "scinames_codes", "users", "areas"],
+    "u": ["organisms"],
+    "af": ["nomenclatures"],
+    "d": ["nomenclatures", "acquisition_frameworks"],
+    "v": ["nomenclatures"],
+}
+NOMENCLATURES_TYPES = ["s", "oc", "af", "d", "v"]
+# Reason of removal of duplicated observations
+DUPLICATE_REASON = "observation duplicated"
+
+
+class AllKeys:
+    """Keys of duplicates when they were not searched first: all keys are remembered."""
+
+    def __contains__(self, key):
+        return True
+
+
+class Parser(Engine):
+    """
+    GeoNature plugin of the engine: transform rows without source nor destination files.
+
+    Lookups are the reference tables of the GeoNature database ("datasets",
+    "nomenclatures", "scinames_codes"...). Optional lookups: "duplicates" (see
+    find_duplicates()), "existing_uuids" needed by check_existing and "areas_index" (see
+    load_areas_index()). With check_types, rows with values of typed columns ("columns.types"
+    parameter) which can not be written in a binary file are removed.
+
+    Example:
+        parser = Parser("s", "/path/actions.ini")
+        for row in parser.process(rows):
+            ...
+        print(parser.render_report())
+    """
+
+    actions_types = ACTIONS_TYPES
+    lookups_names = LOOKUPS
+
+    def __init__(
+        self,
+        import_type,
+        actions=None,
+        lookups=None,
+        duplicates_action=None,
+        geometries_action=None,
+        check_existing=False,
+        attach_areas=False,
+        check_types=False,
+    ):
+        self.duplicates_action = duplicates_action
+        self.geometries_action = geometries_action
+        self.check_existing = check_existing
+        self.attach_areas = attach_areas
+        self.check_types = check_types
+        super().__init__(import_type, actions, lookups)
+        load_nomenclatures()
+
+        if geometries_action is not None and not Config.has("geometries.checks"):
+            print_error("Parameter 'geometries.checks' is missing to check geometries !")
+            exit(1)
+        if attach_areas and not Config.has("areas_index.types"):
+            print_error("Parameter 'areas_index.types' is missing to attach points to areas !")
+            exit(1)
+        if check_types and not Config.has("columns.types"):
+            print_error("Parameter 'columns.types' is missing to write typed columns !")
+            exit(1)
+
+    def build_reports(self):
+        return {
+            "lines_removed_total": 0,
+            "sciname_removed_lines": {},
+            "date_missing_removed_lines": [],
+            "date_max_removed_lines": [],
+            "date_min_in_future_removed_lines": [],
+            "date_max_in_future_removed_lines": [],
+            "source_code_unknown_lines": {},
+            "dataset_code_unknown_lines": {},
+            "area_code_unknown_lines": {},
+            "organism_code_unknown_lines": {},
+            "nomenclature_code_unknown_lines": {},
+            "digitiser_code_unknown_lines": {},
+            "af_code_unknown_lines": {},
+            "altitude_negative_lines": [],
+            "altitude_inverted_lines": [],
+            "altitude_errors_lines": [],
+            "altitude_min_fixed_lines": [],
+            "altitude_max_fixed_lines": [],
+            "depth_min_fixed_lines": [],
+            "depth_max_fixed_lines": [],
+            "last_action_checked": self.check_existing,
+            "last_action_insert_total": 0,
+            "last_action_update_total": 0,
+            "duplicates_checked": self.duplicates_action is not None,
+            "uuid_duplicate_lines": {},
+            "source_pk_duplicate_lines": {},
+            "fields_checked": False,
+            "malformed_lines": [],
+            "geometries_checked": self.geometries_action is not None,
+            "geometry_invalid_lines": {},
+            "types_checked": self.check_types,
+            "typed_value_invalid_lines": {},
+            "areas_attached": self.attach_areas,
+            "area_attached_total": 0,
+            "area_not_found_total": 0,
+            "area_srid_mismatch_total": 0,
+        }
+
+    def get_needed_lookups(self):
+        needed = super().get_needed_lookups()
+        if self.attach_areas and "areas_index" not in self.lookups:
+            needed.append("areas_index")
+        return needed
+
+    def connect_database(self):
+        # Avoid to import psycopg2 when all lookups are given
+        from gn2.db import GnDatabase
+
+        db = GnDatabase()
+        db.connect_to_database()
+        return db
+
+    def load_lookup(self, db, name):
+        if name == "areas_index":
+            return load_areas_index(db)
+        return super().load_lookup(db, name)
+
+    def set_fieldnames(self, fieldnames):
+        """Prepare the transformation of rows with these fieldnames and return destination ones."""
+        is_synthese = self.import_type in ["s", "oc"]
+        if is_synthese and self.check_existing and "existing_uuids" not in self.lookups:
+            print_error("Lookup 'existing_uuids' is missing to check existing observations !")
+            exit(1)
+        super().set_fieldnames(fieldnames)
+
+        self.passthrough_columns = PassthroughColumns(get_passthrough_fieldnames(self.fieldnames))
+        self.transformed_fieldnames = [
+            field for field in self.fieldnames if field not in self.passthrough_columns.fieldnames
+        ]
+        if self.import_type in NOMENCLATURES_TYPES:
+            self.nomenclatures_translator = NomenclaturesTranslator(
+                self.lookups["nomenclatures"], self.fieldnames
+            )
+        if self.geometries_action is not None:
+            self.geometries_checker = GeometriesChecker(
+                Config.get("geometries.checks"), Config.get("null_value_string")
+            )
+        if self.attach_areas:
+            self.areas_geometry_column = Config.get("areas_index.geometry_column")
+        if self.check_types:
+            self.typed_values_checker = TypedValuesChecker(
+                get_columns_types(self.fieldnames, Config.get("columns.types")),
+                Config.get("null_value_string"),
+            )
+        if self.duplicates_action is not None:
+            if "duplicates" not in self.lookups:
+                self.lookups["duplicates"] = {"uuid": AllKeys(), "source_pk": AllKeys()}
+            self.seen_duplicates = {"uuid": set(), "source_pk": set()}
+        return self.fieldnames
+
+    def prepare_row(self, row, reader):
+        # Remove useless columns
+        row = remove_columns(row, reader)
+
+        # Add new columns if necessary
+        row = add_columns(row)
+
+        # Insert value in colums
+        row = insert_values_to_columns(row)
+
+        # Maintain protected char
+        row = force_protected_char(row, self.transformed_fieldnames)
+        row = self.passthrough_columns.force_protected_char(row)
+        return row
+
+    def check_rows(self, rows, reader, reasons):
+        # Check values of typed columns before writing them in a binary file
+        if self.check_types:
+            for row in rows:
+                if not check_typed_values(row, self.typed_values_checker, reader, self.reports):
+                    self.reports["lines_removed_total"] += 1
+                    reasons.append("invalid typed value")
+                    print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+                    break
+
+    def transform_synthese(self, row, reader, reasons):
+        lookups = self.lookups
+        reports = self.reports
+        if self.import_type == "oc":
+            # Add observation UUID
+            row = add_uuid_cor_counting_occtax(row)
+        # Add observation UUID
+        row = add_uuid_obs(row)
+
+        # Replace empty value in specific columns by NULL
+        row = replace_empty_value(row)
+
+        # Check duplicates of observation UUID and source primary key
+        if self.duplicates_action is not None:
+            is_duplicate = not check_duplicates(
+                row, lookups["duplicates"], self.seen_duplicates, reader, reports
+            )
+            if is_duplicate and self.duplicates_action != "report":
+                reports["lines_removed_total"] += 1
+                reasons.append(DUPLICATE_REASON)
+                print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+
+        # Check Sciname code (checks stop at the first reason: lines are removed only once)
+        if (
+            not reasons
+            and check_sciname_code(row, lookups["scinames_codes"], reader, reports) is False
+        ):
+            reasons.append(f"sciname code {row['cd_nom']} not exists in TaxRef")
+            print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+
+        # Check date_min and date_max
+        if reasons:
+            pass
+        elif check_dates(row, reader, reports) is False:
+            reasons.append("mandatory dates missing")
+            print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+        elif check_date_max_greater_than_min(row, reader, reports) is False:
+            reasons.append("date max not greater than date min")
+            print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+        elif check_date_min_in_future(row, reader, reports) is False:
+            reasons.append("date min in the future")
+            print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+        elif check_date_max_in_future(row, reader, reports) is False:
+            reasons.append("date max in the future")
+            print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+
+        # Check geometries
+        if not reasons and self.geometries_action is not None:
+            is_valid = check_geometries(row, self.geometries_checker, reader, reports)
+            if not is_valid and self.geometries_action == "reject":
+                reports["lines_removed_total"] += 1
+                reasons.append("invalid geometry")
+                print_error(f"Line {reader.line_num} removed, {reasons[-1]} !")
+
+        # Fix altitudes
+        if not reasons:
+            row = fix_altitude_min(row, reader, reports)
+            row = fix_altitude_max(row, reader, reports)
+            # TODO: replace fix_negative_altitudes by a check and not a fix
+            # row = fix_negative_altitudes(row, reader, reports)
+            row = fix_inverted_altitudes(row, reader, reports)
+            row = fix_altitudes_errors(row, reader, reports)
+            row = fix_depth_min(row, reader, reports)
+            row = fix_depth_max(row, reader, reports)
+
+        # Set last action according to existing observations
+        if not reasons and self.check_existing:
+            row = set_last_action(row, lookups["existing_uuids"], reports)
+
+        # Replace codes
+        if not reasons:
+            row = replace_code_dataset(row, lookups["datasets"], reader, reports)
+            row = replace_code_module(row, lookups["modules"])
+            row = replace_code_source(row, lookups["sources"], reader, reports)
+            row = self.nomenclatures_translator.replace(row, reader, reports)
+            row = replace_code_digitiser(row, lookups["users"], reader, reports)
+            row = replace_code_area(row, lookups["areas"], reader, reports)
+            if self.attach_areas:
+                row = attach_area(row, lookups["areas_index"], self.areas_geometry_column, reports)
+        return [row]
+
+    def transform_user(self, row, reader, reasons):
+        row = replace_code_organism(row, self.lookups["organisms"], reader, self.reports)
+        return [row]
+
+    def transform_acquisition_framework(self, row, reader, reasons):
+        row = self.nomenclatures_translator.replace(row, reader, self.reports)
+        row = set_default_description(row)
+        return [row]
+
+    def transform_dataset(self, row, reader, reasons):
+        row = set_default_nomenclature_values(row)
+        row = self.nomenclatures_translator.replace(row, reader, self.reports)
+        row = replace_code_acquisition_framework(
+            row, self.lookups["acquisition_frameworks"], reader, self.reports
+        )
+        row = set_default_description(row)
+        return [row]
+
+    def transform_validation(self, row, reader, reasons):
+        row = self.nomenclatures_translator.replace(row, reader, self.reports)
+        return [row]
+
+    stages = {
+        "s": transform_synthese,
+        "oc": transform_synthese,
+        "u": transform_user,
+        "af": transform_acquisition_framework,
+        "d": transform_dataset,
+        "v": transform_validation,
+    }
+
+
+def load_nomenclatures():
+    nomenclatures_needed = set(
+        ["SYNTHESE", "OCCTAX", "ACQUISITION_FRAMEWORK", "DATASET", "VALIDATION"]
+    )
+    if Config.has("actions.type") and Config.get("actions.type") in nomenclatures_needed:
+        Config.load(Config.nomenclatures_config_file_path)
+
+
+def load_areas_index(db):
+    areas_types = Config.get("areas_index.types")
+    srid = int(Config.get("areas_index.srid"))
+    cell_size = float(Config.get("areas_index.cell_size"))
+    cache_file = (
+        Config.get("areas_index.cache_file") if Config.has("areas_index.cache_file") else ""
+    )
+
+    fingerprint = f"{areas_types}-{srid}-{cell_size}-{db.get_areas_fingerprint(areas_types)}"
+    if cache_file:
+        cache_file = get_cache_file_path(cache_file)
+        areas_index = AreasIndex.load(cache_file, fingerprint)
+        if areas_index is not None:
+            click.echo(f"Areas index loaded from cache: {cache_file}")
+            return areas_index
+
+    areas_index = AreasIndex(cell_size, fingerprint, srid)
+    for area_type, id_area, geom in db.get_areas_geometries(areas_types, srid):
+        areas_index.add(id_area, areas_types.index(area_type), geom)
+    areas_index.sort()
+    if cache_file:
+        areas_index.save(cache_file)
+    return areas_index
@@ -1,12 +1,91 @@
+import functools
+
 import psycopg2
 import psycopg2.extras
 
 from helpers.config import Config
+from helpers.taxref import load_taxref_index
+from helpers.uuids import is_uuid, uuid_to_int
+
+
+class LinesFile:
+    """File-like object reading lines from an iterable, used to stream data to COPY."""
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ""
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        for line in self.lines:
+            chunks.append(f"{line}\n")
+            length += len(line) + 1
+            if size >= 0 and length >= size:
+                break
+        data = "".join(chunks)
+        if size < 0:
+            self.buffer = ""
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def cached_reference(config_keys=(), config_sections=()):
+    """
+    Keep result of a get_all_* method in GnDatabase cache when it is enabled.
+
+    The result is cached by values of the config parameters and sections used by the
+    method: jobs with other actions parameters get their own result.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self):
+            if self.cache is None:
+                return method(self)
+            key = (
+                method.__name__,
+                tuple(repr(Config.get(name)) if Config.has(name) else None for name in config_keys),
+                tuple(repr(sorted(Config.getSection(name).items())) for name in config_sections),
+            )
+            if key not in self.cache:
+                self.cache[key] = method(self)
+            return self.cache[key]
+
+        return wrapper
+
+    return decorator
 
 
 class GnDatabase:
     db_connection = None
     db_cursor = None
+    # Reference tables shared by all instances (daemon mode), see enable_cache()
+    cache = None
+    # Tables read by the cached get_all_* methods, see get_references_fingerprint()
+    reference_tables = [
+        ("gn_meta", "t_datasets"),
+        ("gn_meta", "t_acquisition_frameworks"),
+        ("gn_commons", "t_modules"),
+        ("gn_synthese", "t_sources"),
+        ("ref_geo", "bib_areas_types"),
+        ("ref_geo", "l_areas"),
+        ("ref_nomenclatures", "t_nomenclatures"),
+        ("ref_nomenclatures", "bib_nomenclatures_types"),
+        ("taxonomie", "taxref"),
+        ("utilisateurs", "bib_organismes"),
+        ("utilisateurs", "t_roles"),
+    ]
+
+    @classmethod
+    def enable_cache(cls):
+        cls.cache = {}
+
+    @classmethod
+    def clear_cache(cls):
+        if cls.cache is not None:
+            cls.cache = {}
 
     def connect_to_database(self):
         self.db_connection = psycopg2.connect(
@@ -46,6 +125,7 @@ class GnDatabase:
         records = self.db_cursor.fetchall()
         print(records)
 
+    @cached_reference(config_keys=["fk.datasets"])
     def get_all_datasets(self):
         if Config.has("fk.datasets") and Config.get("fk.datasets") == "UUID":
             code_field = "unique_dataset_id"
@@ -61,9 +141,10 @@ class GnDatabase:
         records = self.db_cursor.fetchall()
         datasets = {}
         for record in records:
-            datasets[record["code"]] = record["id"]
+            datasets[record["code"]] = str(record["id"])
         return datasets
 
+    @cached_reference()
     def get_all_modules(self):
         self.db_cursor.execute(
             """
@@ -74,9 +155,10 @@ class GnDatabase:
         records = self.db_cursor.fetchall()
         modules = {}
         for record in records:
-            modules[record["code"]] = record["id"]
+            modules[record["code"]] = str(record["id"])
         return modules
 
+    @cached_reference()
     def get_all_sources(self):
         self.db_cursor.execute(
             """
@@ -87,9 +169,10 @@ class GnDatabase:
         records = self.db_cursor.fetchall()
         sources = {}
         for record in records:
-            sources[record["code"]] = record["id"]
+            sources[record["code"]] = str(record["id"])
         return sources
 
+    @cached_reference()
     def get_all_areas(self):
         self.db_cursor.execute(
             """
@@ -105,9 +188,96 @@ class GnDatabase:
         areas = {}
         for record in records:
             areas.setdefault(record["type"], {})
-            areas[record["type"]][record["code"]] = record["id"]
+            areas[record["type"]][record["code"]] = str(record["id"])
         return areas
 
+    def get_areas(self, areas_codes):
+        """Get only areas with the given (type, code) tuples."""
+        self.db_cursor.execute(
+            """
+            SELECT
+                bib.type_code AS type,
+                la.id_area AS id,
+                la.area_code AS code
+            FROM ref_geo.bib_areas_types bib
+            JOIN ref_geo.l_areas la ON la.id_type = bib.id_type
+            JOIN unnest(%s::varchar[], %s::varchar[]) AS wanted(type, code)
+                ON (wanted.type = bib.type_code AND wanted.code = la.area_code)
+        """,
+            (
+                [area_type for area_type, area_code in areas_codes],
+                [area_code for area_type, area_code in areas_codes],
+            ),
+        )
+        records = self.db_cursor.fetchall()
+        areas = {}
+        for record in records:
+            areas.setdefault(record["type"], {})
+            areas[record["type"]][record["code"]] = str(record["id"])
+        return areas
+
+    def get_references_fingerprint(self):
+        """Get a value changing when rows of reference tables are inserted, updated or deleted."""
+        self.db_cursor.execute(
+            """
+            SELECT sum(st.n_tup_ins + st.n_tup_upd + st.n_tup_del)::text AS changes
+            FROM pg_stat_user_tables AS st
+            JOIN unnest(%s::varchar[], %s::varchar[]) AS wanted(schema, name)
+                ON (wanted.schema = st.schemaname AND wanted.name = st.relname)
+        """,
+            (
+                [schema for schema, name in self.reference_tables],
+                [name for schema, name in self.reference_tables],
+            ),
+        )
+        return self.db_cursor.fetchone()["changes"]
+
+    def get_areas_fingerprint(self, areas_types):
+        """Get a value changing when areas of the given types are added, removed or updated."""
+        self.db_cursor.execute(
+            """
+            SELECT
+                count(la.id_area) AS areas_number,
+                max(la.id_area) AS max_id,
+                max(la.meta_update_date)::text AS max_update_date
+            FROM ref_geo.bib_areas_types bib
+            JOIN ref_geo.l_areas la ON la.id_type = bib.id_type
+            WHERE bib.type_code = ANY(%s::varchar[])
+        """,
+            (list(areas_types),),
+        )
+        record = self.db_cursor.fetchone()
+        return f"{record['areas_number']}-{record['max_id']}-{record['max_update_date']}"
+
+    def get_areas_geometries(self, areas_types, srid):
+        """Get WKB geometries, in the given SRID, of enabled areas of the given types."""
+        cursor = self.db_connection.cursor(
+            name="areas_geometries", cursor_factory=psycopg2.extras.DictCursor
+        )
+        cursor.execute(
+            """
+            SELECT
+                bib.type_code AS type,
+                la.id_area AS id,
+                ST_AsBinary(ST_Transform(la.geom, %s)) AS geom
+            FROM ref_geo.bib_areas_types bib
+            JOIN ref_geo.l_areas la ON la.id_type = bib.id_type
+            WHERE bib.type_code = ANY(%s::varchar[])
+                AND la.enable = true
+                AND la.geom IS NOT NULL
+        """,
+            (srid, list(areas_types)),
+        )
+        while True:
+            records = cursor.fetchmany(1000)
+            if not records:
+                break
+            for record in records:
+                yield (record["type"], str(record["id"]), record["geom"])
+        cursor.close()
+        self.db_connection.commit()
+
+    @cached_reference(config_sections=["NOMENCLATURES"])
     def get_all_nomenclatures(self):
         nomenclatures_columns_types = Config.getSection("NOMENCLATURES")
         types = list(nomenclatures_columns_types.values())
@@ -127,22 +297,58 @@ class GnDatabase:
         nomenclatures = {}
         for record in records:
             nomenclatures.setdefault(record["type"], {})
-            nomenclatures[record["type"]][record["code"]] = record["id"]
+            nomenclatures[record["type"]][record["code"]] = str(record["id"])
         return nomenclatures
 
+    @cached_reference()
     def get_all_scinames_codes(self):
+        """Get the TaxRef index of scinames codes (cd_nom), see TaxrefIndex."""
+        return load_taxref_index(self)
+
+    def get_taxref_fingerprint(self):
+        """Get a value changing with the TaxRef version: number, maximum and sum of codes."""
         self.db_cursor.execute(
             """
-            SELECT DISTINCT cd_nom AS code, lb_nom AS name
+            SELECT
+                count(cd_nom) AS scinames_number,
+                max(cd_nom) AS max_cd_nom,
+                sum(cd_ref::bigint) AS cd_refs_sum
+            FROM taxonomie.taxref
+        """
+        )
+        record = self.db_cursor.fetchone()
+        return f"{record['scinames_number']}-{record['max_cd_nom']}-{record['cd_refs_sum']}"
+
+    def get_taxref_codes(self):
+        """Get (cd_nom, cd_ref) of all TaxRef scinames, streamed by a server side cursor."""
+        cursor = self.db_connection.cursor(name="taxref_codes")
+        cursor.itersize = 100000
+        cursor.execute(
+            """
+            SELECT cd_nom, cd_ref
             FROM taxonomie.taxref
         """
         )
+        yield from cursor
+        cursor.close()
+
+    def get_scinames_codes(self, codes):
+        """Get only scinames with the given codes (cd_nom)."""
+        self.db_cursor.execute(
+            """
+            SELECT DISTINCT cd_nom AS code, lb_nom AS name
+            FROM taxonomie.taxref
+            WHERE cd_nom = ANY(%s)
+        """,
+            ([int(code) for code in codes if code.isdigit()],),
+        )
         records = self.db_cursor.fetchall()
         codes = {}
         for record in records:
             codes[str(record["code"])] = record["name"]
         return codes
 
+    @cached_reference(config_keys=["fk.organisms"])
     def get_all_organisms(self):
         if Config.has("fk.organisms") and Config.get("fk.organisms") == "UUID":
             code_field = "uuid_organisme"
@@ -158,7 +364,7 @@ class GnDatabase:
         records = self.db_cursor.fetchall()
         organisms = {}
         for record in records:
-            organisms[record["code"]] = record["id"]
+            organisms[record["code"]] = str(record["id"])
         return organisms
 
     def check_sciname_code(self, sciname_code):
@@ -172,6 +378,7 @@ class GnDatabase:
         )
         return self.db_cursor.fetchone() is not None
 
+    @cached_reference(config_keys=["fk.af"])
     def get_all_acquisition_frameworks(self):
         if Config.has("fk.af") and Config.get("fk.af") == "UUID":
             code_field = "unique_acquisition_framework_id"
@@ -187,9 +394,10 @@ class GnDatabase:
         records = self.db_cursor.fetchall()
         acquisition_frameworks = {}
         for record in records:
-            acquisition_frameworks[record["code"]] = record["id"]
+            acquisition_frameworks[record["code"]] = str(record["id"])
         return acquisition_frameworks
 
+    @cached_reference(config_keys=["fk.users"])
     def get_all_users(self):
         if Config.has("fk.users") and Config.get("fk.users") == "UUID":
             code_field = "uuid_role"
@@ -205,5 +413,65 @@ class GnDatabase:
         records = self.db_cursor.fetchall()
         users = {}
         for record in records:
-            users[str(record["code"])] = record["id"]
+            users[str(record["code"])] = str(record["id"])
         return users
+
+    def get_users(self, codes):
+        """Get only users with the given codes."""
+        if Config.has("fk.users") and Config.get("fk.users") == "UUID":
+            code_field = "uuid_role"
+            codes = [code for code in codes if is_uuid(code)]
+            codes_type = "uuid[]"
+        else:
+            code_field = "identifiant"
+            codes_type = "varchar[]"
+
+        self.db_cursor.execute(
+            f"""
+            SELECT {code_field} AS code, id_role AS id
+            FROM utilisateurs.t_roles
+            WHERE {code_field} = ANY(%s::{codes_type})
+        """,
+            (list(codes),),
+        )
+        records = self.db_cursor.fetchall()
+        users = {}
+        for record in records:
+            users[str(record["code"])] = str(record["id"])
+        return users
+
+    def get_existing_synthese_uuids(self, uuids):
+        """
+        Get, as 128 bits integers, the given UUIDs already present in gn_synthese.synthese.
+
+        UUIDs are streamed with COPY in a temporary table joined once with the synthese.
+        """
+        self.db_cursor.execute(
+            """
+            CREATE TEMPORARY TABLE tmp_import_uuids (unique_id_sinp uuid) ON COMMIT DROP
+        """
+        )
+        self.db_cursor.copy_expert(
+            "COPY tmp_import_uuids (unique_id_sinp) FROM STDIN", LinesFile(uuids)
+        )
+        self.db_cursor.execute("ANALYZE tmp_import_uuids")
+
+        existing_uuids = set()
+        cursor = self.db_connection.cursor(name="existing_synthese_uuids")
+        cursor.execute(
+            """
+            SELECT DISTINCT t.unique_id_sinp::text
+            FROM tmp_import_uuids AS t
+                INNER JOIN gn_synthese.synthese AS s
+                    ON (s.unique_id_sinp = t.unique_id_sinp)
+        """
+        )
+        while True:
+            records = cursor.fetchmany(10000)
+            if not records:
+                break
+            for record in records:
+                existing_uuids.add(uuid_to_int(record[0]))
+        cursor.close()
+        self.db_connection.commit()
+        return existing_uuids
@@ -1,6 +1,7 @@
 import re
-import uuid
+import csv
 import datetime
+import functools
 from collections import OrderedDict
 
 
@@ -9,14 +10,41 @@ from helpers.helpers import (
     print_msg,
     print_info,
     print_error,
-    is_uuid,
+    build_itemgetter,
     is_empty_or_null,
     get_date_format,
 )
+from helpers.uuids import is_uuid, uuid_to_int, UuidGenerator
+from helpers.duplicates import hash_key, DuplicatesFinder
+from helpers.ewkb import decode_ewkb
 
 # TODO: use at least one class to store all methods
 # TODO: for code (source, dataset) replacement, see if we set a NULL value or if we ignore the line
 
+PROTECTED_CHARS_PATTERN = re.compile(r"[\r\n\t]")
+# Columns read or modified by check_*, fix_*, replace_* and set_default_* functions
+TRANSFORMED_COLUMNS_PATTERN = re.compile(
+    "|".join(
+        [
+            r"unique_id_sinp.*",
+            r"entity_source_pk_value",
+            r"code_.*",
+            r"cd_nom",
+            r"cd_hab",
+            r"count_m(in|ax)",
+            r"altitude_m(in|ax)",
+            r"depth_m(in|ax)",
+            r"precision",
+            r"date_m(in|ax)",
+            r".*_date",
+            r"additional_data",
+            r"(meta_)?last_action",
+            r"name",
+            r"desc",
+        ]
+    )
+)
+
 
 # Computing CSV file number of lines without header line
 def calculate_csv_entries_number(file_handle):
@@ -31,6 +59,113 @@ def calculate_csv_entries_number(file_handle):
     return total_lines
 
 
+# Get distinct values of some columns to load only needed codes from the database
+def collect_distinct_codes(filename, dialect, fieldnames):
+    print_msg(f"Collecting distinct values of columns: {', '.join(fieldnames)}...")
+    codes = {field: set() for field in fieldnames}
+    with open(filename, "r", newline="", encoding="utf-8") as file_handle:
+        reader = csv.reader(file_handle, dialect=dialect)
+        header = next(reader)
+        indexes = {}
+        for field in fieldnames:
+            if field not in header:
+                continue
+            # Values set by actions.set_values replace source values
+            value = get_set_value(field)
+            if value is not None:
+                codes[field].add(value)
+            else:
+                indexes[field] = header.index(field)
+
+        for values in reader:
+            for field, index in indexes.items():
+                if index < len(values):
+                    codes[field].add(values[index])
+
+    null_value_string = Config.get("null_value_string")
+    for field in fieldnames:
+        codes[field].discard("")
+        codes[field].discard(null_value_string)
+        print_info(f"Number of distinct {field} values: {len(codes[field])}")
+    return codes
+
+
+# Yield (UUID, source code, source primary key) of each observation of a file. UUIDs are
+# given as they will be after add_uuid_obs() when they are predictable, else None
+def iter_obs_identifiers(filename, dialect):
+    with open(filename, "r", newline="", encoding="utf-8") as file_handle:
+        reader = csv.reader(file_handle, dialect=dialect)
+        header = next(reader)
+        fields = ["unique_id_sinp", "code_source", "entity_source_pk_value"]
+        indexes = [header.index(field) if field in header else None for field in fields]
+        max_index = max([index for index in indexes if index is not None], default=-1)
+        # Values set by actions.set_values replace source values, like in Parser.prepare_row()
+        set_values = [get_set_value(field) if field in header else None for field in fields]
+        deterministic = (
+            Config.get("actions.add_uuid_obs")
+            and UuidGenerator.is_deterministic()
+            and None not in indexes
+        )
+
+        for values in reader:
+            if len(values) <= max_index:
+                continue
+            (uuid_value, source, source_pk) = [
+                set_value if set_value is not None else values[index] if index is not None else None
+                for index, set_value in zip(indexes, set_values)
+            ]
+            if not is_uuid(uuid_value):
+                uuid_value = None
+                if deterministic:
+                    row = {"code_source": source, "entity_source_pk_value": source_pk}
+                    uuid_value = UuidGenerator.generate(row, "unique_id_sinp")
+            yield (uuid_value, source, source_pk)
+
+
+def collect_obs_uuids(filename, dialect):
+    print_msg("Collecting observations UUIDs...")
+    for uuid_value, source, source_pk in iter_obs_identifiers(filename, dialect):
+        if uuid_value is not None:
+            yield uuid_value
+
+
+# Get keys of observations UUIDs and source primary keys present more than once in a file
+def find_duplicates(filename, dialect, expected_items=None):
+    print_msg("Searching duplicates of observations UUIDs and source primary keys...")
+    memory_limit = 1000000
+    if Config.has("duplicates.memory_limit"):
+        memory_limit = int(Config.get("duplicates.memory_limit"))
+    if not (Config.has("duplicates.bloom") and Config.get("duplicates.bloom")):
+        expected_items = None
+    finders = {
+        "uuid": DuplicatesFinder(memory_limit=memory_limit, expected_items=expected_items),
+        "source_pk": DuplicatesFinder(memory_limit=memory_limit, expected_items=expected_items),
+    }
+    if finders["uuid"].needs_count():
+        # Bloom filters give candidates which must be counted with a second pass
+        passes = [
+            [finders["uuid"].add, finders["source_pk"].add],
+            [finders["uuid"].count, finders["source_pk"].count],
+        ]
+    else:
+        passes = [[finders["uuid"].add, finders["source_pk"].add]]
+
+    null_value_string = Config.get("null_value_string")
+    for add_uuid_key, add_source_pk_key in passes:
+        for uuid_value, source, source_pk in iter_obs_identifiers(filename, dialect):
+            if uuid_value is not None:
+                add_uuid_key(uuid_to_int(uuid_value))
+            if source_pk and source_pk != null_value_string:
+                add_source_pk_key(hash_key(source or "", source_pk))
+
+    duplicates = {key_type: finder.get_duplicates() for key_type, finder in finders.items()}
+    print_info(
+        f"Number of duplicated observations UUIDs: {len(duplicates['uuid'])}, "
+        + f"source primary keys: {len(duplicates['source_pk'])}"
+    )
+    return duplicates
+
+
 # Remove row entries where fieldname match pattern
 def remove_headers(fieldnames):
     output = fieldnames.copy()
@@ -43,6 +178,33 @@ def remove_headers(fieldnames):
     return output
 
 
+# Get fieldnames of columns never read nor modified by the parser
+def get_passthrough_fieldnames(fieldnames):
+    transformed_patterns = [TRANSFORMED_COLUMNS_PATTERN]
+    if Config.get("actions.set_values"):
+        for pattern in Config.get("actions.set_values.params").keys():
+            transformed_patterns.append(re.compile(pattern))
+    if Config.get("actions.add_columns"):
+        for params in get_add_columns_params():
+            transformed_patterns.append(re.compile(re.escape(params["new_field"])))
+    if Config.has("reports.field"):
+        transformed_patterns.append(re.compile(re.escape(Config.get("reports.field"))))
+
+    passthrough_fieldnames = []
+    for field in fieldnames:
+        if not [pattern for pattern in transformed_patterns if pattern.fullmatch(field)]:
+            passthrough_fieldnames.append(field)
+    return passthrough_fieldnames
+
+
+# Get fieldnames of columns which can be kept as bytes by MmapTsvReader
+def get_raw_fieldnames(fieldnames):
+    kept_fieldnames = remove_headers(fieldnames)
+    raw_fieldnames = set(fieldnames) - set(kept_fieldnames)
+    raw_fieldnames.update(get_passthrough_fieldnames(kept_fieldnames))
+    return raw_fieldnames
+
+
 # Add new header entries if necessary
 def add_headers(fieldnames):
     if Config.get("actions.add_columns"):
@@ -152,30 +314,112 @@ def insert_values_to_columns(row):
     return row
 
 
-def force_protected_char(row):
-    fieldnames = list(row.keys())
+# Get the value set by actions.set_values for a field, None if not set
+def get_set_value(field):
+    value = None
+    if Config.get("actions.set_values"):
+        col_values = Config.get("actions.set_values.params")
+        for pattern, col_value in col_values.items():
+            if re.match(rf"^{pattern}$", field):
+                value = col_value
+    return value
+
+
+def force_protected_char(row, fieldnames=None):
+    fieldnames = list(row.keys()) if fieldnames is None else fieldnames
     for field in fieldnames:
-        value = row[field]
-        if value is not None:
+        value = row.get(field)
+        if isinstance(value, str) and PROTECTED_CHARS_PATTERN.search(value):
             value = re.sub(r"\r\n", "\\r\\n", value)
             value = re.sub(r"\n", "\\n", value)
             value = re.sub(r"\r", "\\r", value)
             value = re.sub(r"\t", "\\t", value)
-        row[field] = value
+            row[field] = value
     return row
 
 
+class PassthroughColumns:
+    """
+    Columns never read nor modified by the parser (see get_passthrough_fieldnames()).
+
+    Their values are checked all at once for protected chars. Values kept as bytes by
+    MmapTsvReader never contain them and are not checked.
+    """
+
+    def __init__(self, fieldnames):
+        self.fieldnames = fieldnames
+        self.get_values = build_itemgetter(fieldnames)
+
+    def force_protected_char(self, row):
+        values = self.get_values(row)
+        if not values or values[0].__class__ is bytes:
+            return row
+        try:
+            has_protected_char = PROTECTED_CHARS_PATTERN.search("\x00".join(values))
+        except TypeError:
+            # Some values are None, for lines with missing fields
+            has_protected_char = True
+        if has_protected_char:
+            row = force_protected_char(row, self.fieldnames)
+        return row
+
+
 def add_uuid_obs(row):
     if Config.get("actions.add_uuid_obs"):
         if not is_uuid(row["unique_id_sinp"]):
-            row["unique_id_sinp"] = uuid.uuid4()
+            row["unique_id_sinp"] = UuidGenerator.generate(row, "unique_id_sinp")
     return row
 
 
 def add_uuid_cor_counting_occtax(row):
     if Config.get("actions.add_uuid_cor_counting_occtax"):
         if not is_uuid(row["unique_id_sinp_occtax"]):
-            row["unique_id_sinp_occtax"] = uuid.uuid4()
+            row["unique_id_sinp_occtax"] = UuidGenerator.generate(row, "unique_id_sinp_occtax")
+    return row
+
+
+# Check if the observation UUID or the source primary key of the row was already seen in the file
+def check_duplicates(row, duplicates, seen_keys, reader, reports):
+    is_ok = True
+    uuid_value = row.get("unique_id_sinp")
+    if duplicates["uuid"] and is_uuid(uuid_value):
+        key = uuid_to_int(uuid_value)
+        if key in seen_keys["uuid"]:
+            is_ok = False
+            report_value = get_report_field_value(row, reader)
+            reports["uuid_duplicate_lines"].setdefault(uuid_value, []).append(report_value)
+        elif key in duplicates["uuid"]:
+            seen_keys["uuid"].add(key)
+
+    source_pk = row.get("entity_source_pk_value")
+    if duplicates["source_pk"] and not is_empty_or_null(source_pk):
+        source = row.get("code_source") or ""
+        key = hash_key(source, source_pk)
+        if key in seen_keys["source_pk"]:
+            is_ok = False
+            report_value = get_report_field_value(row, reader)
+            (
+                reports["source_pk_duplicate_lines"]
+                .setdefault(f"{source}-{source_pk}", [])
+                .append(report_value)
+            )
+        elif key in duplicates["source_pk"]:
+            seen_keys["source_pk"].add(key)
+    return is_ok
+
+
+# Set last action to update if the observation UUID already exists in the database, else insert
+def set_last_action(row, existing_uuids, reports):
+    if "last_action" not in row or row["last_action"] != "D":
+        action = "I"
+        if is_uuid(row["unique_id_sinp"]) and uuid_to_int(row["unique_id_sinp"]) in existing_uuids:
+            action = "U"
+        if "last_action" in row:
+            row["last_action"] = action
+        if action == "U":
+            reports["last_action_update_total"] += 1
+        else:
+            reports["last_action_insert_total"] += 1
     return row
 
 
@@ -221,6 +465,38 @@ def get_report_field_value(row, reader):
     return value
 
 
+def check_geometries(row, geometries_checker, reader, reports):
+    is_ok = True
+    for column in geometries_checker.checks:
+        if column in row:
+            error = geometries_checker.check(column, row[column])
+            if error is not None:
+                is_ok = False
+                report_value = get_report_field_value(row, reader)
+                (
+                    reports["geometry_invalid_lines"]
+                    .setdefault(f"{column}: {error}", [])
+                    .append(report_value)
+                )
+    return is_ok
+
+
+def check_typed_values(row, typed_values_checker, reader, reports):
+    is_ok = True
+    for column in typed_values_checker.columns_types:
+        if column in row:
+            error = typed_values_checker.check(column, row[column])
+            if error is not None:
+                is_ok = False
+                report_value = get_report_field_value(row, reader)
+                (
+                    reports["typed_value_invalid_lines"]
+                    .setdefault(f"{column}: {error}", [])
+                    .append(report_value)
+                )
+    return is_ok
+
+
 def check_sciname_code(row, scinames_codes, reader, reports):
     exists = True
     if row["cd_nom"] is not None and row["cd_nom"] != Config.get("null_value_string"):
@@ -366,8 +642,8 @@ def fix_negative_altitudes(row, reader, reports):
         msg = f"WARNING ({report_value}): altitudes min ({row['altitude_min']}) - max ({row['altitude_max']}) negatives !"
         print_error(msg)
 
-        row["depth_min"] = max(int(row["altitude_min"]), int(row["altitude_max"]))
-        row["depth_max"] = min(int(row["altitude_min"]), int(row["altitude_max"]))
+        row["depth_min"] = str(max(int(row["altitude_min"]), int(row["altitude_max"])))
+        row["depth_max"] = str(min(int(row["altitude_min"]), int(row["altitude_max"])))
         row["altitude_min"] = Config.get("null_value_string")
         row["altitude_max"] = Config.get("null_value_string")
     return row
@@ -510,6 +786,30 @@ def replace_code_area(row, areas, reader, reports):
             row["code_nomenclature_info_geo_type"] = Config.get("null_value_string")
     return row
 
+
+def attach_area(row, areas_index, geometry_column, reports):
+    if "code_area_attachment" in row.keys() and is_empty_or_null(row["code_area_attachment"]):
+        geometry = row.get(geometry_column)
+        if not is_empty_or_null(geometry):
+            try:
+                (srid, bbox) = decode_ewkb(geometry)
+            except ValueError:
+                return row
+            # Only points are attached
+            if bbox is not None and bbox[0] == bbox[2] and bbox[1] == bbox[3]:
+                # Points with another SRID than the areas index one can't be located
+                if srid is not None and srid != areas_index.srid:
+                    reports["area_srid_mismatch_total"] += 1
+                    return row
+                id_area = areas_index.find(bbox[0], bbox[1])
+                if id_area is not None:
+                    row["code_area_attachment"] = id_area
+                    reports["area_attached_total"] += 1
+                else:
+                    reports["area_not_found_total"] += 1
+    return row
+
+
 def set_default_description(row):
     if "desc" in row.keys() and is_empty_or_null(row["desc"]):
         if "name" in row.keys() and not is_empty_or_null(row["name"]):
@@ -539,23 +839,77 @@ def replace_code_nomenclature(row, nomenclatures, reader, reports):
                 try:
                     row[field] = nomenclatures[nomenclature_type][code]
                 except KeyError:
-                    report_value = get_report_field_value(row, reader)
-                    msg = [
-                        f"WARNING ({report_value}): nomenclature entry missing !",
-                        f"\tNomenclature type: {nomenclature_type}",
-                        f"\tCode: {code}",
-                        "\tSet to null value string !",
-                    ]
-                    print_error("\n".join(msg))
-                    (
-                        reports["nomenclature_code_unknown_lines"]
-                        .setdefault(f"{nomenclature_type}-{code}", [])
-                        .append(report_value)
-                    )
+                    report_missing_nomenclature(row, reader, reports, nomenclature_type, code)
                     row[field] = Config.get("null_value_string")
     return row
 
 
+def report_missing_nomenclature(row, reader, reports, nomenclature_type, code):
+    report_value = get_report_field_value(row, reader)
+    msg = [
+        f"WARNING ({report_value}): nomenclature entry missing !",
+        f"\tNomenclature type: {nomenclature_type}",
+        f"\tCode: {code}",
+        "\tSet to null value string !",
+    ]
+    print_error("\n".join(msg))
+    (
+        reports["nomenclature_code_unknown_lines"]
+        .setdefault(f"{nomenclature_type}-{code}", [])
+        .append(report_value)
+    )
+
+
+class NomenclaturesTranslator:
+    """
+    Replace nomenclature codes like replace_code_nomenclature() with a LRU cache.
+
+    Rows share few combinations of nomenclature codes: the tuple of codes of all
+    nomenclature columns is translated once, with the missing codes found, then
+    the translated tuple is reused and the missing codes are reported again.
+    """
+
+    def __init__(self, nomenclatures, fieldnames, cache_size=4096):
+        columns_types = Config.getSection("NOMENCLATURES")
+        self.nomenclatures = nomenclatures
+        self.fieldnames = [field for field in fieldnames if field.startswith("code_nomenclature_")]
+        self.types = [columns_types[field] for field in self.fieldnames]
+        self.get_codes = build_itemgetter(self.fieldnames)
+        self.null_value_string = Config.get("null_value_string")
+        self.translate = functools.lru_cache(maxsize=cache_size)(self.translate_codes)
+
+    def translate_codes(self, codes):
+        values = []
+        missing_codes = []
+        for nomenclature_type, code in zip(self.types, codes):
+            if code == "":
+                values.append(self.null_value_string)
+            elif code == self.null_value_string:
+                values.append(code)
+            else:
+                value = self.nomenclatures.get(nomenclature_type, {}).get(code)
+                if value is None:
+                    missing_codes.append((nomenclature_type, code))
+                    value = self.null_value_string
+                values.append(value)
+        return (tuple(values), tuple(missing_codes))
+
+    def replace(self, row, reader, reports):
+        if not self.fieldnames:
+            return row
+
+        (values, missing_codes) = self.translate(self.get_codes(row))
+        for nomenclature_type, code in missing_codes:
+            report_missing_nomenclature(row, reader, reports, nomenclature_type, code)
+        row.update(zip(self.fieldnames, values))
+        return row
+
+    def get_hit_rate(self):
+        cache_info = self.translate.cache_info()
+        calls = cache_info.hits + cache_info.misses
+        return cache_info.hits / calls if calls else 0.0
+
+
 def replace_code_organism(row, organisms, reader, reports):
     if "code_organism" in row.keys() and not is_empty_or_null(row["code_organism"]):
         code = row["code_organism"]
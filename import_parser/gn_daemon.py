@@ -0,0 +1,155 @@
+import os
+import glob
+import json
+import time
+import datetime
+import contextlib
+import traceback
+
+import click
+
+# WARNING: must be define before import-parser Python imports
+# Define OS Environment variables
+root_dir = os.path.realpath(f"{os.path.dirname(os.path.abspath(__file__))}/../../")
+config_shared_dir = os.path.realpath(f"{root_dir}/shared/config/")
+app_dir = os.path.realpath(f"{os.path.dirname(os.path.abspath(__file__))}/../")
+config_dir = os.path.realpath(f"{app_dir}/config/")
+os.environ["IMPORT_PARSER.PATHES.ROOT"] = root_dir
+os.environ["IMPORT_PARSER.PATHES.SHARED.CONFIG"] = config_shared_dir
+os.environ["IMPORT_PARSER.PATHES.APP"] = app_dir
+os.environ["IMPORT_PARSER.PATHES.APP.CONFIG"] = config_dir
+
+
+from gn2.db import GnDatabase
+from helpers.config import Config
+from helpers.helpers import print_error, print_info
+from helpers.uuids import UuidGenerator
+from gn_runner import parse_file
+
+
+@click.command()
+@click.argument(
+    "spool_dir",
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "-r",
+    "--refresh",
+    "refresh_interval",
+    type=int,
+    default=3600,
+    help="Maximum number of seconds before reloading reference tables.",
+)
+@click.option(
+    "-p",
+    "--poll",
+    "poll_interval",
+    type=float,
+    default=2.0,
+    help="Number of seconds between two checks of the spool directory.",
+)
+def run_daemon(spool_dir, refresh_interval, poll_interval):
+    """
+    GeoNature 2 Import Parser daemon
+
+    This script runs GeoNature 2 Import Parser jobs dropped in a spool directory,
+    keeping reference tables (datasets, nomenclatures, TaxRef...) in memory between
+    jobs. Reference tables are reloaded when a change is detected in the database
+    statistics of their tables, or after the refresh interval.
+
+    A job is a JSON file suffixed by '.json' like:
+    {"filename": "/path/synthese.csv", "type": "s", "config": "/path/actions.ini",
+    "options": ["--mmap"]}
+
+    A job is run only when an empty file with the same name suffixed by '.ready' exists:
+    create it once the job file is completely written, so a job file still being written
+    is never read.
+
+    The job file is renamed with the '.running' suffix while it runs, then with
+    '.done' or '.failed'. The job output is written in a file suffixed by '.log'.
+    """
+    GnDatabase.enable_cache()
+    references = {"fingerprint": None, "loaded_at": 0}
+    print_info(f"Waiting for jobs in {spool_dir}...")
+    while True:
+        for ready_path in sorted(glob.glob(os.path.join(spool_dir, "*.ready"))):
+            job_path = f"{os.path.splitext(ready_path)[0]}.json"
+            if not os.path.exists(job_path):
+                continue
+            try:
+                refresh_references(references, refresh_interval)
+            except Exception as e:
+                # Database not reachable: the job waits for the next poll
+                print_error(f"Reference tables not checked, job postponed: {e}")
+                break
+            run_job(job_path)
+        time.sleep(poll_interval)
+
+
+def refresh_references(references, refresh_interval):
+    Config.reset()
+    db = GnDatabase()
+    db.connect_to_database()
+    try:
+        fingerprint = db.get_references_fingerprint()
+    finally:
+        db.close()
+
+    is_expired = time.time() - references["loaded_at"] > refresh_interval
+    if fingerprint != references["fingerprint"] or is_expired:
+        GnDatabase.clear_cache()
+        references["fingerprint"] = fingerprint
+        references["loaded_at"] = time.time()
+        print_info("Reference tables will be reloaded.")
+
+
+def run_job(job_path):
+    job_base_path = os.path.splitext(job_path)[0]
+    running_path = f"{job_base_path}.running"
+    try:
+        os.rename(job_path, running_path)
+    except OSError:
+        # Job already taken by another daemon
+        return
+    with contextlib.suppress(OSError):
+        os.remove(f"{job_base_path}.ready")
+
+    start_time = time.time()
+    status = "done"
+    with open(f"{job_base_path}.log", "w") as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                with open(running_path, "r") as f:
+                    job = json.load(f)
+                args = [job["filename"], "-t", job.get("type", "s")]
+                if job.get("config"):
+                    args += ["-c", job["config"]]
+                args += job.get("options", [])
+
+                # Each job starts with its own parameters
+                Config.reset()
+                UuidGenerator.reset()
+                parse_file.main(args=args, prog_name="gn_import_parser", standalone_mode=False)
+            except click.ClickException as e:
+                status = "failed"
+                e.show()
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    status = "failed"
+                    if isinstance(e.code, str):
+                        print(e.code)
+            except Exception:
+                status = "failed"
+                traceback.print_exc()
+    os.rename(running_path, f"{job_base_path}.{status}")
+
+    time_elapsed = datetime.timedelta(seconds=time.time() - start_time)
+    msg = f"Job {os.path.basename(job_base_path)} {status} in {time_elapsed}."
+    if status == "done":
+        print_info(msg)
+    else:
+        print_error(msg)
+
+
+if __name__ == "__main__":
+    run_daemon()
@@ -3,10 +3,12 @@ import sys
 import csv
 import time
 import datetime
-import json
+import contextlib
+
+# Measure time spent to import modules, see startup_duration
+startup_time = time.time()
 
 import click
-from jinja2 import Environment, FileSystemLoader
 
 # WARNING: must be define before import-parser Python imports
 # Define OS Environment variables
@@ -20,44 +22,40 @@ os.environ["IMPORT_PARSER.PATHES.APP"] = app_dir
 os.environ["IMPORT_PARSER.PATHES.APP.CONFIG"] = config_dir
 
 
-from gn2.db import GnDatabase
 from helpers.config import Config
 from helpers.helpers import print_error
+from helpers.tsv import MmapTsvReader, TsvWriter
+from helpers.pipeline import BUFFER_SIZE, PipelinedReader, PipelinedWriter
+from helpers.structure import RecordedLines, StructureCheckedReader
+from helpers.shards import get_shards_filenames, ShardedWriter, TeeWriter
+from helpers.sort import SortedWriter
+from helpers.pgbinary import get_columns_types, PgBinaryWriter
+from helpers.parquet import is_parquet_available, ParquetWriter
+from helpers.progress import Progress
+from helpers.metrics import MetricsExporter
 from gn2.parser import (
     calculate_csv_entries_number,
-    remove_headers,
-    add_headers,
-    remove_columns,
-    add_columns,
-    insert_values_to_columns,
-    force_protected_char,
-    add_uuid_obs,
-    add_uuid_cor_counting_occtax,
-    replace_empty_value,
-    check_sciname_code,
-    check_dates,
-    check_date_max_greater_than_min,
-    check_date_min_in_future,
-    check_date_max_in_future,
-    fix_altitude_min,
-    fix_altitude_max,
-    fix_negative_altitudes,
-    fix_inverted_altitudes,
-    fix_altitudes_errors,
-    fix_depth_min,
-    fix_depth_max,
-    replace_code_dataset,
-    replace_code_module,
-    replace_code_source,
-    replace_code_nomenclature,
-    replace_code_digitiser,
-    replace_code_area,
-    replace_code_organism,
-    set_default_description,
-    set_default_nomenclature_values,
-    replace_code_acquisition_framework,
+    collect_distinct_codes,
+    collect_obs_uuids,
+    find_duplicates,
+    get_raw_fieldnames,
+)
+from gn2.api import DUPLICATE_REASON, Parser
+from engine import (
+    get_dialects,
+    print_actions_parameters,
+    register_dialects,
+    render_report,
+    save_report,
 )
 
+startup_duration = time.time() - startup_time
+
+# Column of the removal reason in the file of rejected lines (--rejected option)
+REJECTION_REASON_FIELD = "rejection_reason"
+# Column of the values used to dispatch lines in shards (--shard-by option)
+SHARD_FIELDS = {"dataset": "code_dataset", "source": "code_source"}
+
 
 @click.command()
 @click.argument(
@@ -93,10 +91,168 @@ from gn2.parser import (
     "-r",
     "--report",
     "report_dir",
-    default=False,
+    default=None,
     help="Directory where the report file is stored.",
 )
-def parse_file(filename, import_type, actions_config_file, report_dir):
+@click.option(
+    "-m",
+    "--mmap",
+    "use_mmap",
+    is_flag=True,
+    default=False,
+    help="Read source file with a memory map. Only for tsv reader and writer dialects.",
+)
+@click.option(
+    "-p",
+    "--pipeline",
+    "use_pipeline",
+    is_flag=True,
+    default=False,
+    help="Read and write files in separate threads to overlap I/O with parsing.",
+)
+@click.option(
+    "--prescan",
+    "use_prescan",
+    is_flag=True,
+    default=False,
+    help="Scan source file first to load only used scinames, areas and users from the database.",
+)
+@click.option(
+    "--check-existing",
+    "check_existing",
+    is_flag=True,
+    default=False,
+    help="Set last_action to I or U according to observations UUIDs already in the synthese.",
+)
+@click.option(
+    "-d",
+    "--duplicates",
+    "duplicates_action",
+    type=click.Choice(["report", "drop", "route"]),
+    default=None,
+    help="""Search duplicated observations UUIDs and source primary keys, then:
+        report (=only in the report),
+        drop (=remove duplicates from destination file),
+        route (=move duplicates to a file suffixed by '_duplicates').
+    """,
+)
+@click.option(
+    "--rejected",
+    "write_rejected",
+    is_flag=True,
+    default=False,
+    help="Write removed lines, with a rejection reason, in a file suffixed by '_rejected'.",
+)
+@click.option(
+    "--check-fields/--no-check-fields",
+    "check_fields",
+    default=False,
+    help="Move lines with a number of fields different from the header, or unreadable, "
+    "in a file suffixed by '_malformed' instead of stopping.",
+)
+@click.option(
+    "--shards",
+    "shards_number",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of destination files (shards), each one with its own header.",
+)
+@click.option(
+    "--shard-by",
+    "shard_by",
+    type=click.Choice(["line", "dataset", "source"]),
+    default="line",
+    help="""How lines are dispatched between shards:
+        line (=round-robin),
+        dataset (=by a hash of code_dataset),
+        source (=by a hash of code_source).
+    """,
+)
+@click.option(
+    "--sort",
+    "sort_rows",
+    is_flag=True,
+    default=False,
+    help="Sort destination lines by the columns of 'sort.keys' actions parameter.",
+)
+@click.option(
+    "-f",
+    "--format",
+    "output_format",
+    type=click.Choice(["csv", "pgbinary"]),
+    default="csv",
+    help="""Format of destination file:
+        csv (=CSV with writer dialect),
+        pgbinary (=PostgreSQL binary COPY format, with column types of 'columns.types').
+    """,
+)
+@click.option(
+    "--parquet",
+    "write_parquet",
+    is_flag=True,
+    default=False,
+    help="Write also destination lines in a Parquet file, with column types of 'columns.types'.",
+)
+@click.option(
+    "-g",
+    "--geometries",
+    "geometries_action",
+    type=click.Choice(["report", "reject"]),
+    default=None,
+    help="""Check geometries (EWKB, SRID and envelope of 'geometries.checks'), then:
+        report (=only in the report),
+        reject (=remove lines with invalid geometries).
+    """,
+)
+@click.option(
+    "--attach-areas",
+    "attach_areas",
+    is_flag=True,
+    default=False,
+    help="Attach points without area code to areas of 'areas_index.types' with a local index.",
+)
+@click.option(
+    "--progress-interval",
+    "progress_interval",
+    type=float,
+    default=30.0,
+    help="Seconds between two progress lines when the output is not a terminal.",
+)
+@click.option(
+    "--status-file",
+    "status_file",
+    default=None,
+    help="JSON file updated with the progress of the parsing (rows, rows/s, ETA...).",
+)
+@click.option(
+    "--metrics",
+    "metrics_file",
+    default=None,
+    help="OpenMetrics textfile, for node_exporter textfile collector, updated during the run.",
+)
+def parse_file(
+    filename,
+    import_type,
+    actions_config_file,
+    report_dir,
+    use_mmap,
+    use_pipeline,
+    use_prescan,
+    check_existing,
+    duplicates_action,
+    write_rejected,
+    check_fields,
+    shards_number,
+    shard_by,
+    sort_rows,
+    output_format,
+    write_parquet,
+    geometries_action,
+    attach_areas,
+    progress_interval,
+    status_file,
+    metrics_file,
+):
     """
     GeoNature 2 Import Parser
 
@@ -118,34 +274,53 @@ def parse_file(filename, import_type, actions_config_file, report_dir):
     start_time = time.time()
 
     filename_src = click.format_filename(filename)
-    filename_dest = os.path.splitext(filename_src)[0] + "_rti.csv"
-
-    set_actions_type(import_type)
-    load_actions_config_file(actions_config_file)
-    load_nomenclatures()
+    dest_extension = ".bin" if output_format == "pgbinary" else ".csv"
+    filename_dest = os.path.splitext(filename_src)[0] + "_rti" + dest_extension
+    filenames_dest = get_shards_filenames(filename_dest, shards_number)
+    filename_parquet = os.path.splitext(filename_src)[0] + "_rti.parquet"
+    filename_duplicates = os.path.splitext(filename_src)[0] + "_duplicates.csv"
+    filename_rejected = os.path.splitext(filename_src)[0] + "_rejected.csv"
+    filename_malformed = os.path.splitext(filename_src)[0] + "_malformed.csv"
+
+    metrics = MetricsExporter(
+        metrics_file,
+        {"runner": "gn", "type": import_type},
+        info={"file": os.path.basename(filename_src)},
+    )
+    metrics.stages["startup"] = startup_duration
+    metrics.start_stage("configuration")
+    parser = Parser(
+        import_type,
+        actions_config_file,
+        duplicates_action=duplicates_action,
+        geometries_action=geometries_action,
+        check_existing=check_existing,
+        attach_areas=attach_areas,
+        check_types=output_format == "pgbinary" or write_parquet,
+    )
+    metrics.reports = parser.reports
+    metrics.lookups = parser.lookups_durations
 
-    reader_dialect = Config.get("csv.reader.dialect") if Config.has("csv.reader.dialect") else "tsv"
-    writer_dialect = Config.get("csv.writer.dialect") if Config.has("csv.writer.dialect") else "tsv"
+    reader_dialect, writer_dialect = get_dialects()
 
     click.echo("Source filename:" + filename_src)
-    click.echo("Destination filename:" + filename_dest)
+    click.echo("Destination filename:" + ", ".join(filenames_dest))
     click.echo("Type:" + import_type)
-    click.echo("Remove columns ? " + str(Config.get("actions.remove_columns")))
-    click.echo("Columns to remove: " + ", ".join(Config.get("actions.remove_columns.params")))
-    click.echo("Add columns ? " + str(Config.get("actions.add_columns")))
-    click.echo(
-        "Columns to add: "
-        + json.dumps(
-            Config.get("actions.add_columns.params"), indent=4, sort_keys=True, default=str
-        )
-    )
-    click.echo("Set columns values ? " + str(Config.get("actions.set_values")))
-    click.echo(
-        "Columns to set values: "
-        + json.dumps(Config.get("actions.set_values.params"), indent=4, sort_keys=True, default=str)
-    )
-    click.echo(f"CSV Reader dialect: {reader_dialect}")
-    click.echo(f"CSV Writer dialect: {writer_dialect}")
+    click.echo(f"Startup time: {startup_duration:.3f}s")
+    print_actions_parameters()
+    click.echo(f"Memory-mapped reader ? {use_mmap}")
+    click.echo(f"Pipelined I/O ? {use_pipeline}")
+    click.echo(f"Prescan codes ? {use_prescan}")
+    click.echo(f"Check existing observations ? {check_existing}")
+    click.echo(f"Duplicates action: {duplicates_action}")
+    click.echo(f"Write rejected lines ? {write_rejected}")
+    click.echo(f"Check number of fields ? {check_fields}")
+    click.echo(f"Shards: {shards_number} (by {shard_by})")
+    click.echo(f"Sort lines ? {sort_rows}")
+    click.echo(f"Output format: {output_format}")
+    click.echo(f"Write Parquet file ? {write_parquet}")
+    click.echo(f"Geometries action: {geometries_action}")
+    click.echo(f"Attach points to areas ? {attach_areas}")
     click.echo(
         "fk.organisms ? "
         + (str(Config.get("fk.organisms")) if Config.has("fk.organisms") else "none")
@@ -153,269 +328,262 @@ def parse_file(filename, import_type, actions_config_file, report_dir):
     click.echo("fk.af ? " + (str(Config.get("fk.af")) if Config.has("fk.af") else "none"))
     click.echo("fk.users ? " + (str(Config.get("fk.users")) if Config.has("fk.users") else "none"))
 
-    csv.register_dialect(
-        "ssv",
-        delimiter=";",
-        quotechar='"',
-        doublequote=True,
-        quoting=csv.QUOTE_ALL,
-        lineterminator="\r\n",
-    )
-    csv.register_dialect(
-        "ssv-minimal",
-        delimiter=";",
-        quotechar='"',
-        doublequote=True,
-        quoting=csv.QUOTE_MINIMAL,
-        lineterminator="\n",
-    )
-    csv.register_dialect(
-        "tsv",
-        delimiter="\t",
-        quotechar='"',
-        doublequote=True,
-        quoting=csv.QUOTE_MINIMAL,
-        lineterminator="\n",
-    )
+    register_dialects()
+
+    if write_parquet and not is_parquet_available():
+        print_error("Package pyarrow must be installed to write a Parquet file !")
+        exit(1)
+
+    if use_mmap and (reader_dialect != "tsv" or writer_dialect != "tsv"):
+        print_error("Memory-mapped reader can only be used with tsv reader and writer dialects !")
+        exit(1)
 
     # Access to the database if necessary
     db_access_need = set(["s", "oc", "u", "af", "d", "v"])
     if import_type in db_access_need:
+        metrics.start_stage("database")
+        # Import psycopg2 only when the database is needed
+        from gn2.db import GnDatabase
+
         db = GnDatabase()
         db.connect_to_database()
         # Show database infos
         db.print_database_infos()
 
-    # If necessary, get infos in the database
-    if import_type in ["s", "oc"]:
-        datasets = db.get_all_datasets()
-        modules = db.get_all_modules()
-        sources = db.get_all_sources()
-        nomenclatures = db.get_all_nomenclatures()
-        scinames_codes = db.get_all_scinames_codes()
-        users = db.get_all_users()
-        areas = db.get_all_areas()
-    elif import_type == "u":
-        organisms = db.get_all_organisms()
-    elif import_type == "af":
-        nomenclatures = db.get_all_nomenclatures()
-    elif import_type == "d":
-        nomenclatures = db.get_all_nomenclatures()
-        acquisition_frameworks = db.get_all_acquisition_frameworks()
-    elif import_type == "v":
-        nomenclatures = db.get_all_nomenclatures()
+        # If necessary, get infos in the database
+        if import_type in ["s", "oc"] and use_prescan:
+            codes = collect_distinct_codes(
+                filename_src, reader_dialect, ["cd_nom", "code_digitiser", "code_area_attachment"]
+            )
+            parser.set_lookup("scinames_codes", db.get_scinames_codes, codes["cd_nom"])
+            parser.set_lookup("users", db.get_users, codes["code_digitiser"])
+            parser.set_lookup(
+                "areas",
+                db.get_areas,
+                [code.split(".")[:2] for code in codes["code_area_attachment"] if "." in code],
+            )
+        parser.load_lookups(db)
+        if attach_areas:
+            click.echo(f"Number of areas in index: {parser.lookups['areas_index'].areas_number}")
+        if import_type in ["s", "oc"] and check_existing:
+            existing_uuids = parser.set_lookup(
+                "existing_uuids",
+                db.get_existing_synthese_uuids,
+                collect_obs_uuids(filename_src, reader_dialect),
+            )
+            click.echo(f"Number of observations already in the synthese: {len(existing_uuids)}")
 
-    if import_type in db_access_need:
         db.close()
 
     # Open CSV files
-    with open(filename_src, "r", newline="", encoding="utf-8") as f_src:
+    metrics.start_stage("prescan")
+    if use_mmap:
+        f_src = open(filename_src, "rb")
+    else:
+        f_src = open(filename_src, "r", newline="", encoding="utf-8")
+    with f_src:
         total_csv_lines_nbr = calculate_csv_entries_number(f_src)
-        # TODO: add an option to analyse number of tabulation by lines
-        # TODO: create a class to manage reports
-        # TODO: use a template (JINJA ?) to render reports
-        reports = {
-            "lines_removed_total": 0,
-            "sciname_removed_lines": {},
-            "date_missing_removed_lines": [],
-            "date_max_removed_lines": [],
-            "date_min_in_future_removed_lines": [],
-            "date_max_in_future_removed_lines": [],
-            "source_code_unknown_lines": {},
-            "dataset_code_unknown_lines": {},
-            "area_code_unknown_lines": {},
-            "organism_code_unknown_lines": {},
-            "nomenclature_code_unknown_lines": {},
-            "digitiser_code_unknown_lines": {},
-            "af_code_unknown_lines": {},
-            "altitude_negative_lines": [],
-            "altitude_inverted_lines": [],
-            "altitude_errors_lines": [],
-            "altitude_min_fixed_lines": [],
-            "altitude_max_fixed_lines": [],
-            "depth_min_fixed_lines": [],
-            "depth_max_fixed_lines": [],
-        }
-
-        reader = csv.DictReader(f_src, dialect=reader_dialect)
-        with open(filename_dest, "w", newline="", encoding="utf-8") as f_dest:
-            fieldnames = remove_headers(reader.fieldnames)
-            fieldnames = add_headers(fieldnames)
-            writer = csv.DictWriter(f_dest, dialect=writer_dialect, fieldnames=fieldnames)
+        reports = parser.reports
+        reports["fields_checked"] = check_fields
+
+        if duplicates_action is not None and import_type in ["s", "oc"]:
+            parser.lookups["duplicates"] = find_duplicates(
+                filename_src, reader_dialect, total_csv_lines_nbr
+            )
+
+        buffering = BUFFER_SIZE if use_pipeline else -1
+        if use_mmap:
+            reader = MmapTsvReader(f_src)
+            mmap_reader = reader
+            reader.set_raw_fieldnames(get_raw_fieldnames(reader.fieldnames))
+            dest_mode = {"mode": "wb"}
+        else:
+            # Lines of records are kept to write malformed ones as read
+            records = RecordedLines(f_src) if check_fields else f_src
+            reader = csv.DictReader(records, dialect=reader_dialect)
+            dest_mode = {"mode": "w", "newline": "", "encoding": "utf-8"}
+        if output_format == "pgbinary":
+            dest_mode = {"mode": "wb"}
+        # Writers buffering rows are closed, even on errors, before their files: in reverse
+        # order of their creation, as contexts of dest_files
+        with contextlib.ExitStack() as dest_files:
+            fieldnames = parser.set_fieldnames(reader.fieldnames)
+            click.echo("Pass-through columns: " + ", ".join(parser.passthrough_columns.fieldnames))
+            if output_format == "pgbinary" or write_parquet:
+                columns_types = get_columns_types(fieldnames, Config.get("columns.types"))
+            writers = []
+            for filename_shard in filenames_dest:
+                f_dest = dest_files.enter_context(
+                    open(filename_shard, buffering=buffering, **dest_mode)
+                )
+                if output_format == "pgbinary":
+                    writers.append(
+                        PgBinaryWriter(
+                            f_dest, fieldnames, columns_types, Config.get("null_value_string")
+                        )
+                    )
+                    dest_files.callback(writers[-1].close)
+                elif use_mmap:
+                    writers.append(TsvWriter(f_dest, fieldnames=fieldnames))
+                else:
+                    writers.append(
+                        csv.DictWriter(f_dest, dialect=writer_dialect, fieldnames=fieldnames)
+                    )
+            if shards_number > 1:
+                shard_fieldname = SHARD_FIELDS.get(shard_by)
+                if shard_fieldname is not None and shard_fieldname not in fieldnames:
+                    print_error(f"Column {shard_fieldname} is missing to shard lines !")
+                    exit(1)
+                writer = ShardedWriter(writers, shard_fieldname)
+            else:
+                writer = writers[0]
+            if write_parquet:
+                row_group_size = (
+                    int(Config.get("parquet.row_group_size"))
+                    if Config.has("parquet.row_group_size")
+                    else 100000
+                )
+                parquet_writer = ParquetWriter(
+                    filename_parquet,
+                    fieldnames,
+                    columns_types,
+                    Config.get("null_value_string"),
+                    row_group_size,
+                )
+                dest_files.callback(parquet_writer.close)
+                writer = TeeWriter([writer, parquet_writer])
             writer.writeheader()
 
-            # TODO: see why progressbar don't work !
-            with click.progressbar(
-                length=int(total_csv_lines_nbr), label="Parsing lines", show_pos=True
-            ) as pbar:
+            if sort_rows:
+                sort_keys = Config.get("sort.keys") if Config.has("sort.keys") else []
+                missing_keys = [key for key in sort_keys if key not in fieldnames]
+                if not sort_keys or missing_keys:
+                    print_error(f"Sort keys are missing or unknown: {', '.join(missing_keys)} !")
+                    exit(1)
+                click.echo("Sort keys: " + ", ".join(sort_keys))
+                memory_limit = (
+                    int(Config.get("sort.memory_limit"))
+                    if Config.has("sort.memory_limit")
+                    else 100000
+                )
+                writer = SortedWriter(writer, sort_keys, memory_limit)
+                dest_files.callback(writer.close)
+
+            if duplicates_action == "route":
+                if use_mmap:
+                    f_duplicates = dest_files.enter_context(open(filename_duplicates, "wb"))
+                    duplicates_writer = TsvWriter(f_duplicates, fieldnames=fieldnames)
+                else:
+                    f_duplicates = dest_files.enter_context(
+                        open(filename_duplicates, "w", newline="", encoding="utf-8")
+                    )
+                    duplicates_writer = csv.DictWriter(
+                        f_duplicates, dialect=writer_dialect, fieldnames=fieldnames
+                    )
+                duplicates_writer.writeheader()
+
+            if write_rejected:
+                rejected_fieldnames = reader.fieldnames + [REJECTION_REASON_FIELD]
+                if use_mmap:
+                    f_rejected = dest_files.enter_context(
+                        open(filename_rejected, "wb", buffering=BUFFER_SIZE)
+                    )
+                    rejected_writer = TsvWriter(f_rejected, fieldnames=rejected_fieldnames)
+                else:
+                    f_rejected = dest_files.enter_context(
+                        open(
+                            filename_rejected,
+                            "w",
+                            buffering=BUFFER_SIZE,
+                            newline="",
+                            encoding="utf-8",
+                        )
+                    )
+                    rejected_writer = csv.DictWriter(
+                        f_rejected,
+                        dialect=reader_dialect,
+                        fieldnames=rejected_fieldnames,
+                        extrasaction="ignore",
+                    )
+                rejected_writer.writeheader()
+
+            if check_fields:
+                reader = StructureCheckedReader(
+                    reader,
+                    mmap_reader if use_mmap else records,
+                    filename_malformed,
+                    writer_dialect,
+                )
+                checked_reader = reader
+                dest_files.callback(checked_reader.close_malformed_file)
+
+            if use_pipeline:
+                reader = PipelinedReader(reader)
+                # Queued rows are written and the writer thread joined before closing files
+                writer = PipelinedWriter(writer)
+                dest_files.callback(writer.close)
+
+            def on_removed(rows, reasons, original_row):
+                if DUPLICATE_REASON in reasons and duplicates_action == "route":
+                    duplicates_writer.writerows(rows)
+                elif write_rejected:
+                    original_row[REJECTION_REASON_FIELD] = " ; ".join(reasons)
+                    rejected_writer.writerow(original_row)
+
+            metrics.start_stage("parsing")
+            metrics.write()
+            with Progress(
+                total_csv_lines_nbr,
+                total_bytes=os.path.getsize(filename_src),
+                get_position=(lambda: mmap_reader.position) if use_mmap else f_src.buffer.tell,
+                interval=progress_interval,
+                status_file=status_file,
+                on_update=lambda: metrics.update(parser.rows_number, parser.removed_rows_number),
+            ) as progress:
                 try:
-                    for row in reader:
-                        # Initialize variables
-                        write_row = True
-
-                        # TODO: check if number of fields is egal to number of columns,
-                        # else there is a tab in fields value !
-
-                        # Remove useless columns
-                        row = remove_columns(row, reader)
-
-                        # Add new columns if necessary
-                        row = add_columns(row)
-
-                        # Insert value in colums
-                        row = insert_values_to_columns(row)
-
-                        # Maintain protected char
-                        row = force_protected_char(row)
-
-                        if import_type == "s" or import_type == "oc":
-                            if import_type == "oc":
-                                # Add observation UUID
-                                row = add_uuid_cor_counting_occtax(row)
-                            # Add observation UUID
-                            row = add_uuid_obs(row)
-
-                            # Replace empty value in specific columns by NULL
-                            row = replace_empty_value(row)
-
-                            # Check Sciname code
-                            if check_sciname_code(row, scinames_codes, reader, reports) is False:
-                                write_row = False
-                                print_error(
-                                    f"Line {reader.line_num} removed, sciname code {row['cd_nom']} not exists in TaxRef !"
-                                )
-
-                            # Check date_min and date_max
-                            if check_dates(row, reader, reports) is False:
-                                write_row = False
-                                print_error(
-                                    f"Line {reader.line_num} removed, mandatory dates missing !"
-                                )
-                            elif check_date_max_greater_than_min(row, reader, reports) is False:
-                                write_row = False
-                                print_error(
-                                    f"Line {reader.line_num} removed, date max not greater than date min !"
-                                )
-                            elif check_date_min_in_future(row, reader, reports) is False:
-                                write_row = False
-                                print_error(
-                                    f"Line {reader.line_num} removed, date min in the future !"
-                                )
-                            elif check_date_max_in_future(row, reader, reports) is False:
-                                write_row = False
-                                print_error(
-                                    f"Line {reader.line_num} removed, date max in the future !"
-                                )
-
-                            # Fix altitudes
-                            if write_row is not False:
-                                row = fix_altitude_min(row, reader, reports)
-                                row = fix_altitude_max(row, reader, reports)
-                                # TODO: replace fix_negative_altitudes by a check and not a fix
-                                #row = fix_negative_altitudes(row, reader, reports)
-                                row = fix_inverted_altitudes(row, reader, reports)
-                                row = fix_altitudes_errors(row, reader, reports)
-                                row = fix_depth_min(row, reader, reports)
-                                row = fix_depth_max(row, reader, reports)
-
-                            # Replace codes
-                            if write_row is not False:
-                                row = replace_code_dataset(row, datasets, reader, reports)
-                                row = replace_code_module(row, modules)
-                                row = replace_code_source(row, sources, reader, reports)
-                                row = replace_code_nomenclature(row, nomenclatures, reader, reports)
-                                row = replace_code_digitiser(row, users, reader, reports)
-                                row = replace_code_area(row, areas, reader, reports)
-                        elif import_type == "u":
-                            row = replace_code_organism(row, organisms, reader, reports)
-                        elif import_type == "af":
-                            row = replace_code_nomenclature(row, nomenclatures, reader, reports)
-                            row = set_default_description(row)
-                        elif import_type == "d":
-                            row = set_default_nomenclature_values(row)
-                            row = replace_code_nomenclature(row, nomenclatures, reader, reports)
-                            row = replace_code_acquisition_framework(
-                                row, acquisition_frameworks, reader, reports
-                            )
-                            row = set_default_description(row)
-                        elif import_type == "v":
-                            row = replace_code_nomenclature(row, nomenclatures, reader, reports)
-
-                        # Write in destination file
-                        if write_row is True:
-                            writer.writerow(row)
-
-                        # Update progressbar
-                        # pbar.update(int(reader.line_num))
-                        pbar.update(1)
+                    parser.run(
+                        reader,
+                        writer,
+                        on_removed=on_removed,
+                        keep_original=write_rejected,
+                        progress=progress,
+                    )
                 except csv.Error as e:
                     sys.exit(f"Error in file {filename}, line {reader.line_num}: {e}")
 
+            metrics.start_stage("finalization")
+            metrics.set_rows(parser.rows_number, parser.removed_rows_number)
+
+            if import_type in ["s", "oc", "af", "d", "v"]:
+                hit_rate = parser.nomenclatures_translator.get_hit_rate()
+                click.echo(f"Nomenclatures cache hit rate: {hit_rate:.1%}")
+            if check_fields:
+                reports["malformed_lines"] = checked_reader.malformed_lines
+                reports["lines_removed_total"] += len(checked_reader.malformed_lines)
+                malformed_rows_number = len(checked_reader.malformed_lines)
+                metrics.set_rows(
+                    metrics.rows_read + malformed_rows_number,
+                    metrics.rows_rejected + malformed_rows_number,
+                )
+
+        if use_mmap:
+            reader.close()
+
+    metrics.end_stage()
+    metrics.write(finished=True)
+
     # Script time elapsed
     time_elapsed = time.time() - start_time
     time_elapsed_for_human = str(datetime.timedelta(seconds=time_elapsed))
 
     # Build and print report
-    app_path = os.environ["IMPORT_PARSER.PATHES.APP"]
-    tpl_path = f"{app_path}/import_parser/templates"
-    action_type = Config.get("actions.type").lower()
-    tpl_file = f"reports/{action_type}.txt.j2"
-    if os.path.exists(f"{tpl_path}/{tpl_file}"):
-        file_loader = FileSystemLoader(searchpath=tpl_path)
-        env = Environment(loader=file_loader)
-        template = env.get_template(tpl_file)
-        report_output = template.render(reports=reports, elapsed_time=time_elapsed_for_human)
+    report_output = render_report(reports, time_elapsed_for_human)
+    if report_output is not None:
         print(report_output)
 
         # Save the report
         if report_dir:
-            if not os.path.exists(report_dir):
-                os.makedirs(report_dir)
-            current_date = datetime.date.today().isoformat()
-            report_path = f"{report_dir}/{current_date}_{action_type}.report.txt"
-            with open(report_path, "w") as fh:
-                fh.write(report_output)
-
-
-def set_actions_type(abbr_type):
-    types = {
-        "af": "ACQUISITION_FRAMEWORK",
-        "d": "DATASET",
-        "o": "ORGANISM",
-        "s": "SYNTHESE",
-        "so": "SOURCE",
-        "u": "USER",
-        "tr": "TAXREF_RANK",
-        "t": "TAXREF",
-        "oc": "OCCTAX",
-        "v": "VALIDATION",
-    }
-    if abbr_type in types:
-        Config.setParameter("actions.type", types[abbr_type])
-    else:
-        print_error(f'Type "{abbr_type}" is not implemented !')
-
-
-def load_actions_config_file(actions_config_file):
-    if actions_config_file != "" and os.path.exists(actions_config_file):
-        print(f"Actions config file: {actions_config_file}")
-        Config.load(actions_config_file)
-        define_current_actions()
-    else:
-        print_error(f'Actions config file "${actions_config_file}" not exists !')
-
-
-def define_current_actions():
-    actions_type = Config.get("actions.type")
-    parameters = Config.getSection(actions_type)
-    for key, value in parameters.items():
-        Config.setParameter(key, value)
-
-
-def load_nomenclatures():
-    nomenclatures_needed = set(["SYNTHESE", "OCCTAX", "ACQUISITION_FRAMEWORK", "DATASET", "VALIDATION"])
-    if Config.has("actions.type") and Config.get("actions.type") in nomenclatures_needed:
-        Config.load(Config.nomenclatures_config_file_path)
+            save_report(report_output, report_dir)
 
 
 if __name__ == "__main__":
@@ -167,6 +167,12 @@ class Config:
                 filtered_items[item[0]] = item[1]
         return filtered_items
 
+    @classmethod
+    def reset(cls):
+        """Forget all parameters: settings files will be loaded again on next use."""
+        cls.configParser = ConfigParser(interpolation=None)
+        cls.initialized = False
+
     @classmethod
     def getConfigParser(cls):
         """Get ConfigParser class itself."""
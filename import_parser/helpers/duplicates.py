@@ -0,0 +1,109 @@
+import hashlib
+import math
+import tempfile
+
+KEY_SIZE = 16
+
+
+def hash_key(*values):
+    """Get a 128 bits integer from string values, to store them compactly."""
+    digest = hashlib.blake2b("\x00".join(values).encode("utf-8"), digest_size=KEY_SIZE).digest()
+    return int.from_bytes(digest, "big")
+
+
+class BloomFilter:
+    """Bloom filter of 128 bits integer keys."""
+
+    def __init__(self, expected_items, error_rate=0.01):
+        expected_items = max(expected_items, 1)
+        self.size = math.ceil(-expected_items * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes_number = max(1, round(self.size / expected_items * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key):
+        """Add a key and return True if it was maybe already added, False if it was not."""
+        # Keys may not be uniform (sequential UUIDs...), so they are hashed again
+        digest = hashlib.blake2b(key.to_bytes(KEY_SIZE, "big"), digest_size=KEY_SIZE).digest()
+        hash_1 = int.from_bytes(digest[:8], "big")
+        hash_2 = int.from_bytes(digest[8:], "big") | 1
+        already_added = True
+        for i in range(self.hashes_number):
+            position = (hash_1 + i * hash_2) % self.size
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                already_added = False
+                self.bits[position >> 3] |= mask
+        return already_added
+
+
+class DuplicatesFinder:
+    """
+    Find 128 bits integer keys added more than once, with a bounded memory.
+
+    Keys are stored in a set. Beyond memory_limit keys, all keys are spilled to temporary
+    partition files (by key modulo) and duplicates are searched partition by partition.
+    With a Bloom filter (expected_items is set), only keys maybe already added are kept as
+    candidates: all keys must then be given a second time to count() to confirm them.
+    """
+
+    def __init__(self, memory_limit=1000000, partitions_number=64, expected_items=None):
+        self.memory_limit = memory_limit
+        self.partitions_number = partitions_number
+        self.seen = set()
+        self.duplicates = set()
+        self.partitions = None
+        self.bloom = None
+        self.candidates = {}
+        if expected_items is not None:
+            self.bloom = BloomFilter(expected_items)
+
+    def needs_count(self):
+        return self.bloom is not None
+
+    def add(self, key):
+        if self.bloom is not None:
+            if self.bloom.add(key):
+                self.candidates[key] = 0
+        elif self.partitions is not None:
+            self.partitions[key % self.partitions_number].write(key.to_bytes(KEY_SIZE, "big"))
+        elif key in self.seen:
+            self.duplicates.add(key)
+        else:
+            self.seen.add(key)
+            if len(self.seen) > self.memory_limit:
+                self.spill()
+
+    def spill(self):
+        self.partitions = [
+            tempfile.TemporaryFile(prefix="import_parser_keys_")
+            for i in range(self.partitions_number)
+        ]
+        for key in self.seen:
+            self.partitions[key % self.partitions_number].write(key.to_bytes(KEY_SIZE, "big"))
+        self.seen = set()
+
+    def count(self, key):
+        if key in self.candidates:
+            self.candidates[key] += 1
+
+    def get_duplicates(self):
+        if self.bloom is not None:
+            return {key for key, count in self.candidates.items() if count > 1}
+
+        if self.partitions is not None:
+            for partition in self.partitions:
+                partition.seek(0)
+                seen = set()
+                while True:
+                    data = partition.read(KEY_SIZE * 65536)
+                    if not data:
+                        break
+                    for offset in range(0, len(data), KEY_SIZE):
+                        key = int.from_bytes(data[offset : offset + KEY_SIZE], "big")
+                        if key in seen:
+                            self.duplicates.add(key)
+                        else:
+                            seen.add(key)
+                partition.close()
+            self.partitions = None
+        return self.duplicates
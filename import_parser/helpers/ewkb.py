@@ -0,0 +1,162 @@
+import binascii
+import struct
+
+# Flags of EWKB geometry type (PostGIS extended WKB)
+EWKB_Z_FLAG = 0x80000000
+EWKB_M_FLAG = 0x40000000
+EWKB_SRID_FLAG = 0x20000000
+EWKB_FLAGS = EWKB_Z_FLAG | EWKB_M_FLAG | EWKB_SRID_FLAG
+
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTI_TYPES = (4, 5, 6, 7)
+
+UNSIGNED_INT = {1: struct.Struct("<I"), 0: struct.Struct(">I")}
+# Most common geometry: little endian 2D point with SRID
+EWKB_POINT_SRID = struct.Struct("<BIIdd")
+EWKB_POINT_SRID_TYPE = POINT | EWKB_SRID_FLAG
+POINTS_STRUCTS = {}
+
+
+def get_points_struct(byte_order, values_number):
+    key = (byte_order, values_number)
+    points_struct = POINTS_STRUCTS.get(key)
+    if points_struct is None:
+        endianness = "<" if byte_order == 1 else ">"
+        points_struct = struct.Struct(f"{endianness}{values_number}d")
+        POINTS_STRUCTS[key] = points_struct
+    return points_struct
+
+
+def decode_ewkb(value):
+    """
+    Decode an hexadecimal (E)WKB string and return its SRID (or None) and its bounding box.
+
+    Only header and coordinates are decoded: no GIS library is needed. The bounding box
+    is a [xmin, ymin, xmax, ymax] list, None for empty geometries.
+    Raise ValueError for invalid geometries.
+    """
+    try:
+        data = binascii.unhexlify(value)
+    except (binascii.Error, ValueError):
+        raise ValueError("invalid hexadecimal string")
+
+    if len(data) == EWKB_POINT_SRID.size:
+        (byte_order, geometry_type, srid, x, y) = EWKB_POINT_SRID.unpack(data)
+        if byte_order == 1 and geometry_type == EWKB_POINT_SRID_TYPE and x == x:
+            return (srid, [x, y, x, y])
+
+    return decode_wkb(data)
+
+
+def decode_wkb(data, rings=None):
+    """
+    Decode binary (E)WKB like decode_ewkb().
+
+    If rings is a list, (xs, ys) coordinates tuples of each polygon ring are added to it.
+    """
+    bbox = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+    try:
+        srid, offset = read_geometry(data, 0, bbox, rings)
+    except struct.error:
+        raise ValueError("truncated geometry")
+    if offset != len(data):
+        raise ValueError("unexpected bytes after geometry")
+    if bbox[0] > bbox[2]:
+        bbox = None
+    return (srid, bbox)
+
+
+def read_geometry(data, offset, bbox, rings=None):
+    byte_order = data[offset]
+    if byte_order not in UNSIGNED_INT:
+        raise ValueError(f"invalid byte order {byte_order}")
+    unsigned_int = UNSIGNED_INT[byte_order]
+    (geometry_type,) = unsigned_int.unpack_from(data, offset + 1)
+    offset += 5
+
+    srid = None
+    if geometry_type & EWKB_SRID_FLAG:
+        (srid,) = unsigned_int.unpack_from(data, offset)
+        offset += 4
+
+    dimensions = 2 + bool(geometry_type & EWKB_Z_FLAG) + bool(geometry_type & EWKB_M_FLAG)
+    base_type = geometry_type & ~EWKB_FLAGS
+    # ISO WKB types: 1000 for Z, 2000 for M and 3000 for ZM
+    if base_type > 1000:
+        dimensions += (0, 1, 1, 2)[min(base_type // 1000, 3)]
+        base_type %= 1000
+
+    if base_type == POINT:
+        offset = read_points(data, offset, byte_order, 1, dimensions, bbox)
+    elif base_type == LINESTRING:
+        (points_number,) = unsigned_int.unpack_from(data, offset)
+        offset = read_points(data, offset + 4, byte_order, points_number, dimensions, bbox)
+    elif base_type == POLYGON:
+        (rings_number,) = unsigned_int.unpack_from(data, offset)
+        offset += 4
+        for ring in range(rings_number):
+            (points_number,) = unsigned_int.unpack_from(data, offset)
+            offset = read_points(
+                data, offset + 4, byte_order, points_number, dimensions, bbox, rings
+            )
+    elif base_type in MULTI_TYPES:
+        (geometries_number,) = unsigned_int.unpack_from(data, offset)
+        offset += 4
+        for geometry in range(geometries_number):
+            (sub_srid, offset) = read_geometry(data, offset, bbox, rings)
+    else:
+        raise ValueError(f"unknown geometry type {base_type}")
+    return (srid, offset)
+
+
+def read_points(data, offset, byte_order, points_number, dimensions, bbox, rings=None):
+    if points_number == 0:
+        return offset
+
+    values = get_points_struct(byte_order, points_number * dimensions).unpack_from(data, offset)
+    xs = values[0::dimensions]
+    ys = values[1::dimensions]
+    # Empty points have NaN coordinates
+    if points_number == 1 and xs[0] != xs[0]:
+        return offset + 8 * dimensions
+    bbox[0] = min(bbox[0], min(xs))
+    bbox[1] = min(bbox[1], min(ys))
+    bbox[2] = max(bbox[2], max(xs))
+    bbox[3] = max(bbox[3], max(ys))
+    if rings is not None:
+        rings.append((xs, ys))
+    return offset + 8 * points_number * dimensions
+
+
+class GeometriesChecker:
+    """
+    Check geometry columns: valid EWKB, expected SRID and bounding box in territory envelope.
+
+    Checks are a dict of columns with their SRID and their envelope, a
+    [xmin, ymin, xmax, ymax] list, like the "geometries.checks" actions parameter.
+    """
+
+    def __init__(self, checks, null_value_string="\\N"):
+        self.checks = checks
+        self.null_values = {None, "", b"", null_value_string, null_value_string.encode("utf-8")}
+
+    def check(self, column, value):
+        """Return an error message, or None if the geometry is valid or null."""
+        if value in self.null_values:
+            return None
+
+        try:
+            (srid, bbox) = decode_ewkb(value)
+        except ValueError as e:
+            return str(e)
+
+        check = self.checks[column]
+        if "srid" in check and srid != check["srid"]:
+            return f"SRID {srid} instead of {check['srid']}"
+        if bbox is not None and "envelope" in check:
+            xmin, ymin, xmax, ymax = check["envelope"]
+            if bbox[0] < xmin or bbox[1] < ymin or bbox[2] > xmax or bbox[3] > ymax:
+                return "out of territory envelope"
+        return None
@@ -1,8 +1,8 @@
+import os
 import click
 import operator
 import itertools
 import uuid
-import re
 
 from helpers.config import Config
 
@@ -24,6 +24,18 @@ def print_verbose(msg):
     click.echo(click.style(msg, fg="black"))
 
 
+def get_cache_file_path(filename):
+    """
+    Get the path of a cache file: relative filenames are in the cache directory of the app,
+    only readable and writable by its owner.
+    """
+    if os.path.isabs(filename):
+        return filename
+    cache_dir = os.path.join(os.environ["IMPORT_PARSER.PATHES.APP"], "var", "cache")
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    return os.path.join(cache_dir, filename)
+
+
 def find_ranges(data):
     """Yield range of consecutive numbers."""
     ranges = []
@@ -34,6 +46,17 @@ def find_ranges(data):
     return ranges
 
 
+def build_itemgetter(keys):
+    """Like operator.itemgetter() but always return a tuple, even for zero or one key."""
+    if len(keys) == 0:
+        return lambda obj: ()
+    elif len(keys) == 1:
+        key = keys[0]
+        return lambda obj: (obj[key],)
+    else:
+        return operator.itemgetter(*keys)
+
+
 def is_uuid_v4(value):
     try:
         return uuid.UUID(value).version == 4
@@ -41,14 +64,6 @@ def is_uuid_v4(value):
         return False
 
 
-def is_uuid(value):
-    return (
-        True
-        if re.search("^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", value)
-        else False
-    )
-
-
 def is_empty_or_null(value):
     is_eon = False
     if value is None:
@@ -0,0 +1,163 @@
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PREFIX = "import_parser"
+# Minimum seconds between two writes of the metrics file during a run
+WRITE_INTERVAL = 15.0
+
+
+def get_peak_rss():
+    """Return the peak resident set size of the process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_reports_counts(reports):
+    """Get the number of lines of each report entry: lists, dicts of lists and totals."""
+    counts = {}
+    for name, value in reports.items():
+        if isinstance(value, bool):
+            continue
+        elif isinstance(value, int):
+            counts[name] = value
+        elif isinstance(value, list):
+            counts[name] = len(value)
+        elif isinstance(value, dict):
+            counts[name] = sum(len(lines) for lines in value.values())
+    return counts
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsExporter:
+    """
+    Write metrics of an import run in an OpenMetrics textfile, for node_exporter.
+
+    Counters of rows are set by the runner, stages are timed one after the other with
+    start_stage(). Without path, nothing is written. The file is replaced at once, so the
+    textfile collector never reads a partial file. Labels are added to all metrics, info
+    labels with many values (like the source file name) only to the run_info metric.
+    """
+
+    def __init__(self, path, labels, info=None):
+        self.path = path
+        self.labels = labels
+        self.info = {} if info is None else info
+        self.start_time = time.time()
+        self.last_write = 0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.reports = {}
+        self.stages = {}
+        self.lookups = {}
+        self.current_stage = None
+
+    def start_stage(self, name):
+        """End the current stage, if any, and start timing a new one."""
+        now = time.monotonic()
+        if self.current_stage is not None:
+            stage_name, stage_start = self.current_stage
+            self.stages[stage_name] = self.stages.get(stage_name, 0) + now - stage_start
+        self.current_stage = (name, now) if name is not None else None
+
+    def end_stage(self):
+        self.start_stage(None)
+
+    def set_rows(self, rows_read, rows_rejected, rows_written=None):
+        """Set rows counters, rows written are the ones not rejected by default."""
+        self.rows_read = rows_read
+        self.rows_rejected = rows_rejected
+        self.rows_written = rows_read - rows_rejected if rows_written is None else rows_written
+
+    def update(self, rows_read=None, rows_rejected=None, rows_written=None):
+        """Write the metrics file if the last write is old enough."""
+        if rows_read is not None:
+            self.set_rows(rows_read, rows_rejected, rows_written)
+        if time.monotonic() - self.last_write >= WRITE_INTERVAL:
+            self.write()
+
+    def write(self, finished=False):
+        if not self.path:
+            return
+        self.last_write = time.monotonic()
+
+        lines = []
+        self.add_metric(lines, "run_info", "gauge", "Information about the run.", [(self.info, 1)])
+        self.add_metric(
+            lines, "rows_read", "gauge", "Rows read from the source file.", self.rows_read
+        )
+        self.add_metric(
+            lines, "rows_written", "gauge", "Rows written in destination files.", self.rows_written
+        )
+        self.add_metric(
+            lines,
+            "rows_rejected",
+            "gauge",
+            "Rows removed from destination files.",
+            self.rows_rejected,
+        )
+        self.add_metric(
+            lines,
+            "report_lines",
+            "gauge",
+            "Number of lines of each report entry.",
+            [({"entry": name}, count) for name, count in get_reports_counts(self.reports).items()],
+        )
+        self.add_metric(
+            lines,
+            "stage_duration_seconds",
+            "gauge",
+            "Duration of each stage of the run.",
+            [({"stage": name}, round(duration, 6)) for name, duration in self.stages.items()],
+        )
+        self.add_metric(
+            lines,
+            "lookup_load_duration_seconds",
+            "gauge",
+            "Duration of the load of each reference table from the database.",
+            [({"lookup": name}, round(duration, 6)) for name, duration in self.lookups.items()],
+        )
+        peak_rss = get_peak_rss()
+        if peak_rss is not None:
+            self.add_metric(
+                lines, "peak_rss_bytes", "gauge", "Peak resident set size of the run.", peak_rss
+            )
+        self.add_metric(
+            lines,
+            "start_timestamp_seconds",
+            "gauge",
+            "Start time of the run.",
+            round(self.start_time, 3),
+        )
+        self.add_metric(
+            lines, "finished", "gauge", "1 if the run is finished, else 0.", int(finished)
+        )
+        lines.append("# EOF")
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def add_metric(self, lines, name, metric_type, help_text, samples):
+        name = f"{PREFIX}_{name}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            labels = {**self.labels, **labels}
+            formatted_labels = ",".join(
+                f'{key}="{escape_label_value(label)}"' for key, label in labels.items()
+            )
+            lines.append(f"{name}{{{formatted_labels}}} {value}")
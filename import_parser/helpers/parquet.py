@@ -0,0 +1,148 @@
+import datetime
+import importlib.util
+import re
+
+from helpers.pgbinary import BOOL_VALUES, ENCODERS, parse_timestamp
+
+# Imported by load_pyarrow() only when a Parquet file is written: it is long to import
+pyarrow = None
+
+# Columns with repetitive values (nomenclatures, datasets...) stored with dictionary encoding
+DEFAULT_DICTIONARY_PATTERN = r"code_.*|meta_v_taxref|last_action"
+
+
+def is_parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def load_pyarrow():
+    global pyarrow
+    if pyarrow is None:
+        import pyarrow
+        import pyarrow.parquet
+    return pyarrow
+
+
+def convert_int(value):
+    return int(value)
+
+
+def convert_bool(value):
+    try:
+        return BOOL_VALUES[value.strip().lower()]
+    except KeyError:
+        raise ValueError(f"Invalid boolean value: {value!r}")
+
+
+def convert_uuid(value):
+    return bytes.fromhex(value.replace("-", ""))
+
+
+def convert_bytes(value):
+    if value.startswith("\\x"):
+        value = value[2:]
+    return bytes.fromhex(value)
+
+
+def convert_date(value):
+    return datetime.date.fromisoformat(value[:10])
+
+
+def get_arrow_types():
+    return {
+        "text": (pyarrow.string(), None),
+        "jsonb": (pyarrow.string(), None),
+        "int4": (pyarrow.int32(), convert_int),
+        "int8": (pyarrow.int64(), convert_int),
+        "bool": (pyarrow.bool_(), convert_bool),
+        "uuid": (pyarrow.binary(16), convert_uuid),
+        "bytea": (pyarrow.binary(), convert_bytes),
+        "geometry": (pyarrow.binary(), convert_bytes),
+        "timestamp": (pyarrow.timestamp("us"), parse_timestamp),
+        "date": (pyarrow.date32(), convert_date),
+    }
+
+
+class ParquetWriter:
+    """
+    Write rows like csv.DictWriter in a Parquet file, with typed columns.
+
+    Column types are the binary COPY ones (see helpers.pgbinary). Rows are buffered by
+    columns and written by row groups of row_group_size rows to bound memory use.
+    The null value string is written as null, and so are empty strings of not text
+    columns. Needs the optional pyarrow package. close() must be called.
+    """
+
+    def __init__(
+        self,
+        path,
+        fieldnames,
+        columns_types,
+        null_value_string="\\N",
+        row_group_size=100000,
+        dictionary_pattern=DEFAULT_DICTIONARY_PATTERN,
+    ):
+        unknown_types = set(columns_types.values()) - set(ENCODERS)
+        if unknown_types:
+            raise ValueError(f"Unknown column types: {', '.join(sorted(unknown_types))}")
+
+        load_pyarrow()
+        arrow_types = get_arrow_types()
+        self.fieldnames = fieldnames
+        self.converters = [arrow_types[columns_types.get(name, "text")][1] for name in fieldnames]
+        self.schema = pyarrow.schema(
+            [(name, arrow_types[columns_types.get(name, "text")][0]) for name in fieldnames]
+        )
+        self.null_values = {None, null_value_string, null_value_string.encode("utf-8")}
+        self.row_group_size = row_group_size
+        self.columns = [[] for name in fieldnames]
+        self.rows_number = 0
+        dictionary_regex = re.compile(dictionary_pattern)
+        self.parquet_writer = pyarrow.parquet.ParquetWriter(
+            path,
+            self.schema,
+            use_dictionary=[name for name in fieldnames if dictionary_regex.fullmatch(name)],
+            compression="zstd",
+        )
+
+    def writeheader(self):
+        pass
+
+    def writerow(self, row):
+        for column, value, converter in zip(
+            self.columns, map(row.get, self.fieldnames), self.converters
+        ):
+            if value in self.null_values:
+                value = None
+            else:
+                if value.__class__ is bytes:
+                    value = value.decode("utf-8")
+                elif value.__class__ is not str:
+                    value = str(value)
+                if converter is not None:
+                    value = converter(value) if value != "" else None
+            column.append(value)
+        self.rows_number += 1
+        if self.rows_number >= self.row_group_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.rows_number > 0:
+            table = pyarrow.Table.from_arrays(
+                [
+                    pyarrow.array(column, type=field.type)
+                    for column, field in zip(self.columns, self.schema)
+                ],
+                schema=self.schema,
+            )
+            self.parquet_writer.write_table(table, row_group_size=self.row_group_size)
+            self.columns = [[] for name in self.fieldnames]
+            self.rows_number = 0
+
+    def close(self):
+        self.flush()
+        self.parquet_writer.close()
@@ -0,0 +1,230 @@
+import binascii
+import datetime
+import functools
+import re
+import struct
+
+SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+# Flags field and header extension area length
+HEADER = SIGNATURE + struct.pack("!ii", 0, 0)
+TRAILER = struct.pack("!h", -1)
+NULL_FIELD = struct.pack("!i", -1)
+POSTGRES_EPOCH = datetime.datetime(2000, 1, 1)
+POSTGRES_EPOCH_DATE = POSTGRES_EPOCH.date()
+# Backslash sequences of the text COPY format, like the ones of force_protected_char()
+COPY_ESCAPE_PATTERN = re.compile(rb"\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))", re.DOTALL)
+COPY_ESCAPES = {b"b": b"\b", b"f": b"\f", b"n": b"\n", b"r": b"\r", b"t": b"\t", b"v": b"\v"}
+# ISO 8601 timestamps, with any fractional seconds digits and time zone ("Z" or offset)
+TIMESTAMP_PATTERN = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?)?"
+    r" ?(?:Z|[+-]\d{2}:?(?:\d{2})?)?"
+)
+BOOL_VALUES = {
+    "t": True,
+    "true": True,
+    "1": True,
+    "yes": True,
+    "on": True,
+    "f": False,
+    "false": False,
+    "0": False,
+    "no": False,
+    "off": False,
+}
+
+
+def replace_copy_escape(match):
+    (octal, hexadecimal, char) = match.groups()
+    if octal is not None:
+        return bytes([int(octal, 8) & 0xFF])
+    if hexadecimal is not None:
+        return bytes([int(hexadecimal, 16)])
+    return COPY_ESCAPES.get(char, char)
+
+
+def decode_copy_escapes(data):
+    """Decode backslash sequences of text COPY format, like PostgreSQL does with text files."""
+    if b"\\" not in data:
+        return data
+    return COPY_ESCAPE_PATTERN.sub(replace_copy_escape, data)
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO 8601 timestamp ("YYYY-MM-DD[ HH:MM[:SS[.ffffff]]][Z|+HH[:MM]]").
+
+    Contrary to datetime.fromisoformat() before Python 3.11, "Z" and fractional seconds
+    of any length are accepted: they are truncated to microseconds. Like a text COPY into
+    a PostgreSQL "timestamp without time zone" column, the time zone is ignored: the
+    returned datetime is naive, with the local time of the value.
+    """
+    match = TIMESTAMP_PATTERN.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Invalid isoformat string: {value!r}")
+    (year, month, day, hour, minute, second, fraction) = match.groups()
+    return datetime.datetime(
+        int(year),
+        int(month),
+        int(day),
+        int(hour or 0),
+        int(minute or 0),
+        int(second or 0),
+        int(fraction[:6].ljust(6, "0")) if fraction else 0,
+    )
+
+
+def encode_text(value):
+    data = value if value.__class__ is bytes else str(value).encode("utf-8")
+    data = decode_copy_escapes(data)
+    return struct.pack("!i", len(data)) + data
+
+
+def encode_int4(value):
+    return struct.pack("!ii", 4, int(value))
+
+
+def encode_int8(value):
+    return struct.pack("!iq", 8, int(value))
+
+
+def encode_bool(value):
+    try:
+        return struct.pack("!i?", 1, BOOL_VALUES[value.strip().lower()])
+    except KeyError:
+        raise ValueError(f"Invalid boolean value: {value!r}")
+
+
+def encode_uuid(value):
+    data = binascii.unhexlify(value.replace("-", ""))
+    if len(data) != 16:
+        raise ValueError(f"{len(data)} bytes instead of 16")
+    return struct.pack("!i", 16) + data
+
+
+def encode_bytea(value):
+    # Hexadecimal strings, with or without PostgreSQL "\x" prefix (WKB or EWKB for geometries)
+    if value.startswith("\\x"):
+        value = value[2:]
+    data = binascii.unhexlify(value)
+    return struct.pack("!i", len(data)) + data
+
+
+def encode_jsonb(value):
+    # Binary format of jsonb is a version number followed by the JSON text
+    data = b"\x01" + decode_copy_escapes(value.encode("utf-8"))
+    return struct.pack("!i", len(data)) + data
+
+
+@functools.lru_cache(maxsize=65536)
+def encode_timestamp(value):
+    delta = parse_timestamp(value) - POSTGRES_EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return struct.pack("!iq", 8, microseconds)
+
+
+@functools.lru_cache(maxsize=65536)
+def encode_date(value):
+    days = (datetime.date.fromisoformat(value[:10]) - POSTGRES_EPOCH_DATE).days
+    return struct.pack("!ii", 4, days)
+
+
+ENCODERS = {
+    "text": encode_text,
+    "int4": encode_int4,
+    "int8": encode_int8,
+    "bool": encode_bool,
+    "uuid": encode_uuid,
+    "bytea": encode_bytea,
+    "geometry": encode_bytea,
+    "jsonb": encode_jsonb,
+    "timestamp": encode_timestamp,
+    "date": encode_date,
+}
+
+
+class TypedValuesChecker:
+    """
+    Check values of typed columns (not text ones): they must be valid for the encoder of
+    their type to be written in a binary COPY or Parquet file.
+
+    Columns types are the ones of get_columns_types().
+    """
+
+    def __init__(self, columns_types, null_value_string="\\N"):
+        self.columns_types = {name: type for name, type in columns_types.items() if type != "text"}
+        self.null_values = {None, "", b"", null_value_string, null_value_string.encode("utf-8")}
+
+    def check(self, column, value):
+        """Return an error message, or None if the value is valid or null."""
+        if value in self.null_values:
+            return None
+
+        type = self.columns_types[column]
+        value = value.decode("utf-8") if value.__class__ is bytes else str(value)
+        try:
+            ENCODERS[type](value)
+        except (ValueError, OverflowError, struct.error):
+            return f"invalid {type} value"
+        return None
+
+
+def get_columns_types(fieldnames, types_patterns):
+    """Get type of each column: first type with a matching column name pattern, else text."""
+    patterns = [(re.compile(pattern), type) for pattern, type in types_patterns.items()]
+    columns_types = {}
+    for fieldname in fieldnames:
+        columns_types[fieldname] = "text"
+        for pattern, type in patterns:
+            if pattern.fullmatch(fieldname):
+                columns_types[fieldname] = type
+                break
+    return columns_types
+
+
+class PgBinaryWriter:
+    """
+    Write rows like csv.DictWriter in a PostgreSQL binary COPY file.
+
+    Values are encoded according to their column type (see ENCODERS). The null value
+    string is written as NULL, and so are empty strings of not text columns.
+    close() must be called to write the file trailer.
+    """
+
+    def __init__(self, file_handle, fieldnames, columns_types, null_value_string="\\N"):
+        unknown_types = set(columns_types.values()) - set(ENCODERS)
+        if unknown_types:
+            raise ValueError(f"Unknown binary COPY types: {', '.join(sorted(unknown_types))}")
+
+        self.file_handle = file_handle
+        self.fieldnames = fieldnames
+        self.encoders = [ENCODERS[columns_types.get(name, "text")] for name in fieldnames]
+        self.text_columns = [columns_types.get(name, "text") == "text" for name in fieldnames]
+        self.null_values = {None, null_value_string, null_value_string.encode("utf-8")}
+        self.fields_number = struct.pack("!h", len(fieldnames))
+
+    def writeheader(self):
+        self.file_handle.write(HEADER)
+
+    def writerow(self, row):
+        line = [self.fields_number]
+        for value, encoder, is_text in zip(
+            map(row.get, self.fieldnames), self.encoders, self.text_columns
+        ):
+            if value in self.null_values:
+                line.append(NULL_FIELD)
+            elif is_text:
+                line.append(encoder(value))
+            else:
+                if value.__class__ is bytes:
+                    value = value.decode("utf-8")
+                else:
+                    value = str(value)
+                line.append(encoder(value) if value != "" else NULL_FIELD)
+        self.file_handle.write(b"".join(line))
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        self.file_handle.write(TRAILER)
@@ -0,0 +1,107 @@
+import queue
+import threading
+
+# Size of destination file buffer used in pipelined mode
+BUFFER_SIZE = 1024 * 1024
+END_OF_ROWS = None
+
+
+class PipelinedReader:
+    """
+    Read rows of a reader (csv.DictReader, MmapTsvReader...) in a separate thread.
+
+    Rows are sent by batches in a bounded queue: the reader thread waits when the queue
+    is full. The line_num attribute is the source line number of the last returned row,
+    so functions using reader.line_num for reports work without change.
+    """
+
+    def __init__(self, reader, batch_size=1000, queue_size=8):
+        self.reader = reader
+        self.fieldnames = reader.fieldnames
+        self.line_num = reader.line_num
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        batch = []
+        try:
+            for row in self.reader:
+                batch.append((self.reader.line_num, row))
+                if len(batch) >= self.batch_size:
+                    self.queue.put(batch)
+                    batch = []
+        except Exception as e:
+            # Raised again in main thread, after rows already read
+            batch.append((self.reader.line_num, e))
+        if batch:
+            self.queue.put(batch)
+        self.queue.put(END_OF_ROWS)
+
+    def __iter__(self):
+        while True:
+            batch = self.queue.get()
+            if batch is END_OF_ROWS:
+                return
+            for line_num, row in batch:
+                self.line_num = line_num
+                if isinstance(row, Exception):
+                    raise row
+                yield row
+
+    def close(self):
+        self.thread.join()
+        self.reader.close()
+
+
+class PipelinedWriter:
+    """
+    Write rows with a writer (csv.DictWriter, TsvWriter...) in a separate thread.
+
+    Rows are sent by batches in a bounded queue: the main thread waits when the queue
+    is full. Rows are written in the order of writerow() calls. Errors of the writer
+    thread are raised in main thread by the next writerow() or close() call.
+    """
+
+    def __init__(self, writer, batch_size=1000, queue_size=8):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.batch = []
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def write(self):
+        while True:
+            batch = self.queue.get()
+            if batch is END_OF_ROWS:
+                return
+            if self.error is None:
+                try:
+                    self.writer.writerows(batch)
+                except Exception as e:
+                    self.error = e
+
+    def writeheader(self):
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.raise_error()
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.put(END_OF_ROWS)
+        self.thread.join()
+        self.raise_error()
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import datetime
+
+# Seconds between two redraws of the progress line on a terminal
+TTY_INTERVAL = 0.5
+
+
+class Progress:
+    """
+    Report the progress of rows parsing: rows/s, bytes/s and ETA.
+
+    The caller counts rows with "progress.rows += 1" and calls update() only when rows
+    reach next_update: the clock is read once per batch of rows, and the batch size is
+    adjusted to the throughput. On a terminal, a progress line is redrawn; otherwise a
+    heartbeat line is printed at each interval. The status can also be written in a
+    JSON file, for monitoring scripts, and on_update is called at each interval.
+    """
+
+    def __init__(
+        self,
+        total_rows,
+        label="Parsing lines",
+        total_bytes=None,
+        get_position=None,
+        interval=30.0,
+        status_file=None,
+        stream=None,
+        on_update=None,
+    ):
+        self.total_rows = total_rows
+        self.label = label
+        self.total_bytes = total_bytes
+        self.get_position = get_position
+        self.stream = sys.stderr if stream is None else stream
+        self.is_tty = self.stream.isatty()
+        self.interval = TTY_INTERVAL if self.is_tty else interval
+        self.status_file = status_file
+        self.on_update = on_update
+        self.rows = 0
+        self.next_update = 1
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.last_rows = 0
+
+    def __enter__(self):
+        self.write_status("running")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish("failed" if exc_type is not None else "done")
+        return False
+
+    def update(self):
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        # Next check when about a tenth of the interval is elapsed
+        rate = (self.rows - self.last_rows) / elapsed if elapsed > 0 else 0
+        self.next_update = self.rows + max(1, min(100000, int(rate * self.interval / 10)))
+        if elapsed >= self.interval:
+            self.last_time = now
+            self.last_rows = self.rows
+            self.display(self.format_status())
+            self.write_status("running")
+            if self.on_update is not None:
+                self.on_update()
+
+    def finish(self, state="done"):
+        self.display(self.format_status())
+        if self.is_tty:
+            self.stream.write("\n")
+            self.stream.flush()
+        self.write_status(state)
+
+    def get_status(self):
+        elapsed = time.monotonic() - self.start_time
+        rows_per_second = self.rows / elapsed if elapsed > 0 else 0
+        status = {
+            "label": self.label,
+            "rows": self.rows,
+            "total_rows": self.total_rows,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(rows_per_second, 1),
+            "eta_seconds": None,
+            "bytes": None,
+            "total_bytes": self.total_bytes,
+            "bytes_per_second": None,
+        }
+        if rows_per_second > 0 and self.total_rows:
+            status["eta_seconds"] = round(max(0, self.total_rows - self.rows) / rows_per_second)
+        if self.get_position is not None and elapsed > 0:
+            position = self.get_position()
+            status["bytes"] = position
+            status["bytes_per_second"] = round(position / elapsed)
+        return status
+
+    def format_status(self):
+        status = self.get_status()
+        parts = [f"{self.label}: {status['rows']}"]
+        if status["total_rows"]:
+            parts[0] += f"/{status['total_rows']}"
+            parts[0] += f" ({min(1, status['rows'] / status['total_rows']):.1%})"
+        parts.append(f"{status['rows_per_second']:.0f} rows/s")
+        if status["bytes_per_second"] is not None:
+            parts.append(f"{status['bytes_per_second'] / 1024 / 1024:.1f} MB/s")
+        if status["eta_seconds"] is not None:
+            parts.append(f"ETA {datetime.timedelta(seconds=status['eta_seconds'])}")
+        return " - ".join(parts)
+
+    def display(self, line):
+        if self.is_tty:
+            self.stream.write(f"\r{line}\033[K")
+        else:
+            self.stream.write(f"[{datetime.datetime.now():%Y-%m-%d %H:%M:%S}] {line}\n")
+        self.stream.flush()
+
+    def write_status(self, state):
+        if not self.status_file:
+            return
+        status = self.get_status()
+        status["state"] = state
+        status["updated_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+        # Replace the file at once: readers never see a partial status
+        tmp_path = f"{self.status_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp_path, self.status_file)
@@ -0,0 +1,78 @@
+import os
+import zlib
+
+
+def get_shards_filenames(filename, shards_number):
+    """Get the file name of each shard: the shard number is added before the extension."""
+    if shards_number <= 1:
+        return [filename]
+
+    base, extension = os.path.splitext(filename)
+    digits = len(str(shards_number))
+    return [f"{base}_{number:0{digits}d}{extension}" for number in range(1, shards_number + 1)]
+
+
+class ShardedWriter:
+    """
+    Dispatch rows between writers (csv.DictWriter, TsvWriter...) of shard files.
+
+    Without fieldname, rows are dispatched round-robin. Otherwise, all rows with the same
+    value of this field are written in the same shard, chosen with a CRC32 of the value:
+    contrary to hash(), it is stable between runs.
+    """
+
+    def __init__(self, writers, fieldname=None):
+        self.writers = writers
+        self.fieldname = fieldname
+        self.shards_number = len(writers)
+        self.rows_number = 0
+        self.writers_by_value = {}
+
+    def writeheader(self):
+        for writer in self.writers:
+            writer.writeheader()
+
+    def writerow(self, row):
+        if self.fieldname is None:
+            writer = self.writers[self.rows_number % self.shards_number]
+            self.rows_number += 1
+        else:
+            value = row.get(self.fieldname)
+            writer = self.writers_by_value.get(value)
+            if writer is None:
+                writer = self.get_writer_by_value(value)
+        writer.writerow(row)
+
+    def get_writer_by_value(self, value):
+        if value is None:
+            data = b""
+        elif value.__class__ is bytes:
+            data = value
+        else:
+            data = str(value).encode("utf-8")
+        writer = self.writers[zlib.crc32(data) % self.shards_number]
+        self.writers_by_value[value] = writer
+        return writer
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+class TeeWriter:
+    """Write each row with all writers (destination file and a Parquet copy...)."""
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    def writeheader(self):
+        for writer in self.writers:
+            writer.writeheader()
+
+    def writerow(self, row):
+        for writer in self.writers:
+            writer.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
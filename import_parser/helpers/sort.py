@@ -0,0 +1,83 @@
+import heapq
+import pickle
+import tempfile
+
+# Number of rows serialized together in temporary files
+CHUNK_SIZE = 1000
+
+
+def get_sort_value(value):
+    """Get a value comparable with any other: integers are sorted numerically, before strings."""
+    if value is None:
+        return (1, 0, "")
+    if value.__class__ is bytes:
+        value = value.decode("utf-8")
+    # Other Unicode digits ("²"...) can not be converted by int()
+    if value.isascii() and value.isdigit():
+        return (0, int(value), "")
+    return (1, 0, value)
+
+
+def build_sort_key(keys):
+    def sort_key(row):
+        return tuple(get_sort_value(row.get(key)) for key in keys)
+
+    return sort_key
+
+
+class SortedWriter:
+    """
+    Sort rows by keys before writing them with a writer (csv.DictWriter, TsvWriter...).
+
+    External merge sort: runs of memory_limit rows are sorted in memory and spilled to
+    temporary files, then close() merges all runs and writes rows. Rows are serialized
+    with pickle, so values with new lines are kept as is. Sort is stable.
+    """
+
+    def __init__(self, writer, keys, memory_limit=100000):
+        self.writer = writer
+        self.sort_key = build_sort_key(keys)
+        self.memory_limit = memory_limit
+        self.rows = []
+        self.runs = []
+
+    def writeheader(self):
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.memory_limit:
+            self.spill()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def spill(self):
+        self.rows.sort(key=self.sort_key)
+        run = tempfile.TemporaryFile(prefix="import_parser_sort_")
+        for start in range(0, len(self.rows), CHUNK_SIZE):
+            pickle.dump(self.rows[start : start + CHUNK_SIZE], run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.runs.append(run)
+        self.rows = []
+
+    def iter_run(self, run):
+        while True:
+            try:
+                rows = pickle.load(run)
+            except EOFError:
+                break
+            yield from rows
+        run.close()
+
+    def close(self):
+        self.rows.sort(key=self.sort_key)
+        if not self.runs:
+            self.writer.writerows(self.rows)
+        else:
+            runs = [self.iter_run(run) for run in self.runs]
+            runs.append(self.rows)
+            self.writer.writerows(heapq.merge(*runs, key=self.sort_key))
+        self.rows = []
+        self.runs = []
@@ -0,0 +1,120 @@
+import os
+import json
+import math
+
+from helpers.ewkb import decode_wkb
+
+
+def is_point_in_rings(x, y, rings):
+    """Even-odd rule on all rings: holes and parts of multipolygons are handled."""
+    inside = False
+    for xs, ys in rings:
+        x1 = xs[-1]
+        y1 = ys[-1]
+        for x2, y2 in zip(xs, ys):
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+            x1 = x2
+            y1 = y2
+    return inside
+
+
+class AreasIndex:
+    """
+    Grid index of areas polygons to find the area containing a point.
+
+    Each area is added in all the cells of size cell_size covered by its bounding box.
+    Areas of a cell are sorted by priority (lower first): the first area containing the
+    point is returned. The index can be saved and loaded as JSON, with a fingerprint of
+    the areas it contains. Points to find must use the SRID of the areas geometries.
+    """
+
+    def __init__(self, cell_size=1000, fingerprint=None, srid=None):
+        self.cell_size = cell_size
+        self.fingerprint = fingerprint
+        self.srid = srid
+        self.cells = {}
+        self.areas_number = 0
+
+    def add(self, id_area, priority, wkb):
+        rings = []
+        (srid, bbox) = decode_wkb(bytes(wkb), rings)
+        if bbox is None:
+            return
+
+        area = (priority, bbox, rings, id_area)
+        for cell_x in range(self.get_cell(bbox[0]), self.get_cell(bbox[2]) + 1):
+            for cell_y in range(self.get_cell(bbox[1]), self.get_cell(bbox[3]) + 1):
+                self.cells.setdefault((cell_x, cell_y), []).append(area)
+        self.areas_number += 1
+
+    def get_cell(self, coordinate):
+        return math.floor(coordinate / self.cell_size)
+
+    def sort(self):
+        for areas in self.cells.values():
+            areas.sort(key=lambda area: area[0])
+
+    def find(self, x, y):
+        """Return the id of the area with the lowest priority containing the point, or None."""
+        areas = self.cells.get((self.get_cell(x), self.get_cell(y)))
+        if areas is None:
+            return None
+
+        for priority, bbox, rings, id_area in areas:
+            if bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]:
+                if is_point_in_rings(x, y, rings):
+                    return id_area
+        return None
+
+    def save(self, path):
+        # Areas are shared by cells: they are saved once and cells keep their positions
+        areas = []
+        areas_positions = {}
+        cells = []
+        for (cell_x, cell_y), cell_areas in self.cells.items():
+            positions = []
+            for area in cell_areas:
+                if id(area) not in areas_positions:
+                    areas_positions[id(area)] = len(areas)
+                    (priority, bbox, rings, id_area) = area
+                    areas.append(
+                        [priority, bbox, [[list(xs), list(ys)] for xs, ys in rings], id_area]
+                    )
+                positions.append(areas_positions[id(area)])
+            cells.append([cell_x, cell_y, positions])
+        data = {
+            "fingerprint": self.fingerprint,
+            "cell_size": self.cell_size,
+            "srid": self.srid,
+            "areas_number": self.areas_number,
+            "areas": areas,
+            "cells": cells,
+        }
+        # Replace the file at once: readers never see a partial index
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """Load a saved index, or return None if it does not exist or is outdated."""
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data["fingerprint"] != fingerprint:
+                return None
+            areas = [
+                (priority, bbox, [(xs, ys) for xs, ys in rings], id_area)
+                for priority, bbox, rings, id_area in data["areas"]
+            ]
+            index = cls(data["cell_size"], fingerprint, data["srid"])
+            index.cells = {
+                (cell_x, cell_y): [areas[position] for position in positions]
+                for cell_x, cell_y, positions in data["cells"]
+            }
+            index.areas_number = data["areas_number"]
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+        return index
@@ -0,0 +1,130 @@
+import csv
+
+from helpers.helpers import print_error
+
+MALFORMED_FIELDNAMES = ["line_number", "error", "line"]
+
+
+class RecordedLines:
+    """
+    Iterate over the lines of a text file opened with newline="", for a csv reader, and
+    keep the lines of the current record.
+
+    Like MmapTsvReader, only "\\n" ends a line: a bare "\\r" stays in its line, so line
+    numbers are the same with both readers.
+    """
+
+    def __init__(self, file_handle):
+        self.file_handle = file_handle
+        self.lines = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.file_handle)
+        while line.endswith("\r"):
+            next_line = next(self.file_handle, "")
+            if not next_line:
+                break
+            line += next_line
+        self.lines.append(line)
+        return line
+
+    def start_record(self):
+        self.lines = []
+
+    def get_record(self):
+        return "".join(self.lines)
+
+
+class StructureCheckedReader:
+    """
+    Return only rows of a reader (csv.DictReader, MmapTsvReader...) with as many fields
+    as the header.
+
+    Readers already split lines on delimiters outside quotes: a row with missing fields
+    (None values) or extra fields (None key) is malformed. Well formed lines are never
+    parsed again. Malformed lines and lines raising a csv.Error are written as read, with
+    their line number, in the malformed file and the iteration continues. The malformed
+    file is only created with the first malformed line.
+
+    Records give the raw text of the current record: the reader itself for a
+    MmapTsvReader, the RecordedLines read by a csv.DictReader otherwise.
+    """
+
+    def __init__(self, reader, records, malformed_path, dialect="tsv"):
+        self.reader = reader
+        self.records = records
+        self.fieldnames = reader.fieldnames
+        self.line_num = reader.line_num
+        self.malformed_path = malformed_path
+        self.malformed_file = None
+        self.dialect = dialect
+        self.malformed_lines = []
+        self.fields_number = len(self.fieldnames)
+        self.last_fieldname = self.fieldnames[-1]
+
+    def __iter__(self):
+        while True:
+            self.records.start_record()
+            try:
+                row = next(self.reader)
+                self.line_num = self.reader.line_num
+            except StopIteration:
+                return
+            except csv.Error as e:
+                self.line_num = self.get_source_line_num()
+                row = self.parse_bare_carriage_return_record()
+                if row is None:
+                    self.add_malformed_line(str(e))
+                    continue
+
+            if None in row or row[self.last_fieldname] is None:
+                fields_number = len([name for name in self.fieldnames if row[name] is not None])
+                fields_number += len(row.get(None, []))
+                self.add_malformed_line(f"{fields_number} fields instead of {self.fields_number}")
+                continue
+            yield row
+
+    def parse_bare_carriage_return_record(self):
+        # Like MmapTsvReader, a bare "\r" outside quotes stays in its field value
+        if not isinstance(self.reader, csv.DictReader):
+            return None
+        dialect = self.reader.reader.dialect
+        record = self.records.get_record().rstrip("\r\n")
+        if "\r" not in record or dialect.quotechar in record:
+            return None
+
+        fields = record.split(dialect.delimiter)
+        row = dict(zip(self.fieldnames, fields))
+        if len(fields) < self.fields_number:
+            for name in self.fieldnames[len(fields) :]:
+                row[name] = None
+        elif len(fields) > self.fields_number:
+            row[None] = fields[self.fields_number :]
+        return row
+
+    def get_source_line_num(self):
+        # csv.DictReader only updates its line number after a successfully read row
+        if isinstance(self.reader, csv.DictReader):
+            return self.reader.reader.line_num
+        return self.reader.line_num
+
+    def add_malformed_line(self, error):
+        if self.malformed_file is None:
+            self.malformed_file = open(self.malformed_path, "w", newline="", encoding="utf-8")
+            self.malformed_writer = csv.writer(self.malformed_file, dialect=self.dialect)
+            self.malformed_writer.writerow(MALFORMED_FIELDNAMES)
+
+        self.malformed_lines.append(self.line_num)
+        print_error(f"Line {self.line_num} removed, malformed line: {error} !")
+        line = self.records.get_record().rstrip("\r\n")
+        self.malformed_writer.writerow([self.line_num, error, line])
+
+    def close_malformed_file(self):
+        if self.malformed_file is not None:
+            self.malformed_file.close()
+
+    def close(self):
+        self.reader.close()
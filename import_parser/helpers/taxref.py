@@ -0,0 +1,149 @@
+import os
+import sys
+import struct
+from array import array
+
+import click
+
+from helpers.config import Config
+from helpers.helpers import get_cache_file_path
+
+# Cache file: magic, fingerprint length, arrays lengths, then fingerprint and arrays
+CACHE_MAGIC = b"IPTAXREF"
+CACHE_HEADER = struct.Struct("<8sIQQQ")
+
+
+class TaxrefIndex:
+    """
+    Index of TaxRef scinames codes (cd_nom) with their taxon code (cd_ref).
+
+    Taxon codes are stored in an array of integers indexed by the sciname code (0 if
+    the sciname code does not exist) and known taxon codes in a bitmap: each lookup is a
+    probe in the array or the bitmap. Codes can be given as strings, like in CSV files.
+    "code in index" is True if the sciname code exists, like with a dict of scinames codes.
+    The index can be saved and loaded with a fingerprint of TaxRef: the cache file only
+    contains raw arrays, nothing is executed to load it.
+    """
+
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.cd_refs = array("i")
+        self.cd_refs_bitmap = bytearray()
+        self.scinames_number = 0
+
+    @classmethod
+    def build(cls, codes, fingerprint=None):
+        """Build the index from an iterable of (cd_nom, cd_ref) integers."""
+        cd_noms = array("i")
+        cd_refs = array("i")
+        for cd_nom, cd_ref in codes:
+            cd_noms.append(cd_nom)
+            cd_refs.append(cd_ref)
+
+        index = cls(fingerprint)
+        index.cd_refs = array("i", [0]) * (max(cd_noms, default=0) + 1)
+        index.cd_refs_bitmap = bytearray((max(cd_refs, default=0) >> 3) + 1)
+        for cd_nom, cd_ref in zip(cd_noms, cd_refs):
+            index.cd_refs[cd_nom] = cd_ref
+            index.cd_refs_bitmap[cd_ref >> 3] |= 1 << (cd_ref & 7)
+        index.scinames_number = len(cd_noms)
+        return index
+
+    def __contains__(self, cd_nom):
+        return self.get_cd_ref(cd_nom) is not None
+
+    def get_cd_ref(self, cd_nom):
+        """Return the taxon code (string) of a sciname code, or None if it does not exist."""
+        cd_nom = to_code(cd_nom)
+        if cd_nom is None or cd_nom >= len(self.cd_refs) or self.cd_refs[cd_nom] == 0:
+            return None
+        return str(self.cd_refs[cd_nom])
+
+    def has_cd_ref(self, cd_ref):
+        """Return True if the taxon code exists."""
+        cd_ref = to_code(cd_ref)
+        if cd_ref is None or (cd_ref >> 3) >= len(self.cd_refs_bitmap):
+            return False
+        return bool(self.cd_refs_bitmap[cd_ref >> 3] & (1 << (cd_ref & 7)))
+
+    def save(self, path):
+        cd_refs = array("i", self.cd_refs)
+        if sys.byteorder == "big":
+            cd_refs.byteswap()
+        fingerprint = str(self.fingerprint).encode("utf-8")
+        header = CACHE_HEADER.pack(
+            CACHE_MAGIC,
+            len(fingerprint),
+            len(cd_refs),
+            len(self.cd_refs_bitmap),
+            self.scinames_number,
+        )
+        # Replace the file at once: readers never see a partial index
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(fingerprint)
+            cd_refs.tofile(f)
+            f.write(self.cd_refs_bitmap)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """Load a saved index, or return None if it does not exist or is outdated."""
+        try:
+            with open(path, "rb") as f:
+                (magic, fingerprint_size, cd_refs_size, bitmap_size, scinames_number) = (
+                    CACHE_HEADER.unpack(f.read(CACHE_HEADER.size))
+                )
+                if magic != CACHE_MAGIC:
+                    return None
+                if f.read(fingerprint_size) != str(fingerprint).encode("utf-8"):
+                    return None
+                index = cls(fingerprint)
+                index.cd_refs.fromfile(f, cd_refs_size)
+                index.cd_refs_bitmap = bytearray(f.read(bitmap_size))
+        except (OSError, EOFError, ValueError, struct.error):
+            return None
+        if len(index.cd_refs_bitmap) != bitmap_size:
+            return None
+        if sys.byteorder == "big":
+            index.cd_refs.byteswap()
+        index.scinames_number = scinames_number
+        return index
+
+
+def to_code(value):
+    """Convert a TaxRef code to a positive integer, or None if it is not one."""
+    if isinstance(value, int):
+        return value if value > 0 else None
+    # Codes with leading zeros are not the ones of TaxRef
+    if value is None or not value.isdigit() or value.startswith("0"):
+        return None
+    try:
+        code = int(value)
+    except ValueError:
+        return None
+    return code if code > 0 else None
+
+
+def load_taxref_index(db):
+    """
+    Load the TaxRef index from the cache file of the current TaxRef version, or build it
+    from the database (GnDatabase or ThDatabase) and save it.
+    """
+    cache_file = (
+        Config.get("taxref_index_cache_file") if Config.has("taxref_index_cache_file") else ""
+    )
+
+    fingerprint = db.get_taxref_fingerprint()
+    if cache_file:
+        cache_file = get_cache_file_path(cache_file)
+        taxref_index = TaxrefIndex.load(cache_file, fingerprint)
+        if taxref_index is not None:
+            click.echo(f"TaxRef index loaded from cache: {cache_file}")
+            return taxref_index
+
+    taxref_index = TaxrefIndex.build(db.get_taxref_codes(), fingerprint)
+    if cache_file:
+        taxref_index.save(cache_file)
+    return taxref_index
@@ -0,0 +1,161 @@
+import csv
+import mmap
+import re
+
+from helpers.helpers import build_itemgetter
+
+
+class MmapTsvReader:
+    """
+    Read a TSV file through a memory map and return rows like csv.DictReader.
+
+    Record and field boundaries are found on bytes. Values of fields set with
+    set_raw_fieldnames() are not decoded: they stay bytes and can be written as is
+    by TsvWriter: they never contain delimiter, quote char or new line chars.
+    Records containing a quote char are parsed by the csv module and all their values
+    are decoded. Only "\\n" ends a line: a bare "\\r" outside quotes stays in its field
+    value, where csv.DictReader would end the record.
+    """
+
+    def __init__(self, file_handle, delimiter="\t", quotechar='"', encoding="utf-8"):
+        self.mm = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.mm)
+        self.position = 0
+        self.line_num = 0
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.bytes_delimiter = delimiter.encode(encoding)
+        self.bytes_quotechar = quotechar.encode(encoding)
+        self.csv_reader = csv.reader(
+            self.iter_lines(), delimiter=delimiter, quotechar=quotechar, doublequote=True
+        )
+        self.fieldnames = next(self.csv_reader)
+        self.fields_number = len(self.fieldnames)
+        self.set_raw_fieldnames([])
+
+    def set_raw_fieldnames(self, raw_fieldnames):
+        self.raw_fieldnames = [name for name in self.fieldnames if name in raw_fieldnames]
+        self.decoded_fieldnames = [
+            name for name in self.fieldnames if name not in self.raw_fieldnames
+        ]
+        self.get_decoded_values = build_itemgetter(
+            [self.fieldnames.index(name) for name in self.decoded_fieldnames]
+        )
+
+    def iter_lines(self):
+        while self.position < self.size:
+            end = self.mm.find(b"\n", self.position)
+            end = self.size if end == -1 else end + 1
+            line = self.mm[self.position : end]
+            self.position = end
+            self.line_num += 1
+            yield line.decode(self.encoding)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.position < self.size:
+            start = self.position
+            end = self.mm.find(b"\n", start)
+            end = self.size if end == -1 else end + 1
+            if self.mm.find(self.bytes_quotechar, start, end) != -1:
+                fields = next(self.csv_reader)
+                if fields:
+                    return self.build_decoded_row(fields)
+                continue
+
+            self.position = end
+            self.line_num += 1
+            line = self.mm[start:end].rstrip(b"\r\n")
+            if line:
+                fields = line.split(self.bytes_delimiter)
+                if b"\r" in line:
+                    # Bare carriage returns are kept in decoded values, never in raw ones
+                    return self.build_decoded_row([field.decode(self.encoding) for field in fields])
+                return self.build_row(fields)
+        raise StopIteration
+
+    def build_row(self, fields):
+        if len(fields) != self.fields_number:
+            return self.build_decoded_row([field.decode(self.encoding) for field in fields])
+
+        row = dict(zip(self.fieldnames, fields))
+        # All decoded values are joined to be decoded with only one call
+        decoded_values = (
+            self.bytes_delimiter.join(self.get_decoded_values(fields))
+            .decode(self.encoding)
+            .split(self.delimiter)
+        )
+        row.update(zip(self.decoded_fieldnames, decoded_values))
+        return row
+
+    def build_decoded_row(self, fields):
+        # Same behavior than csv.DictReader with default restkey and restval
+        row = dict(zip(self.fieldnames, fields))
+        if len(fields) < self.fields_number:
+            for name in self.fieldnames[len(fields) :]:
+                row[name] = None
+        elif len(fields) > self.fields_number:
+            row[None] = fields[self.fields_number :]
+        return row
+
+    def start_record(self):
+        self.record_start = self.position
+
+    def get_record(self):
+        """Return the text of the lines read since start_record()."""
+        return self.mm[self.record_start : self.position].decode(self.encoding, "replace")
+
+    def close(self):
+        self.mm.close()
+
+
+class TsvWriter:
+    """
+    Write rows like csv.DictWriter with the "tsv" dialect in a binary file.
+
+    Bytes values (see MmapTsvReader) are written as is, other values are quoted if
+    necessary and encoded. Keys which are not in fieldnames are ignored.
+    """
+
+    def __init__(
+        self,
+        file_handle,
+        fieldnames,
+        delimiter="\t",
+        quotechar='"',
+        lineterminator="\n",
+        encoding="utf-8",
+    ):
+        self.file_handle = file_handle
+        self.fieldnames = fieldnames
+        self.quotechar = quotechar
+        self.encoding = encoding
+        self.bytes_delimiter = delimiter.encode(encoding)
+        self.bytes_lineterminator = lineterminator.encode(encoding)
+        # Quoted like csv.writer does: only with delimiter, quote char or line terminator chars
+        self.quoting_pattern = re.compile(f"[{re.escape(delimiter + quotechar + lineterminator)}]")
+
+    def writeheader(self):
+        self.writerow(dict(zip(self.fieldnames, self.fieldnames)))
+
+    def writerow(self, row):
+        line = []
+        for value in map(row.get, self.fieldnames):
+            if value is None:
+                line.append(b"")
+            elif value.__class__ is bytes:
+                line.append(value)
+            else:
+                if value.__class__ is not str:
+                    value = str(value)
+                if self.quoting_pattern.search(value):
+                    quotechar = self.quotechar
+                    value = quotechar + value.replace(quotechar, quotechar * 2) + quotechar
+                line.append(value.encode(self.encoding))
+        self.file_handle.write(self.bytes_delimiter.join(line) + self.bytes_lineterminator)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
@@ -0,0 +1,97 @@
+import os
+import re
+import uuid
+
+from helpers.config import Config
+
+# Map an hexadecimal digit to a RFC 4122 variant digit (10xx) keeping its 2 low bits
+VARIANT_DIGITS = {digit: "89ab"[int(digit, 16) & 3] for digit in "0123456789abcdef"}
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+DEFAULT_NAMESPACE = uuid.uuid5(
+    uuid.NAMESPACE_URL, "https://wiki-sinp.cbn-alpin.fr/database/import-formats"
+)
+
+
+def is_uuid(value):
+    return value is not None and len(value) == 36 and UUID_PATTERN.fullmatch(value) is not None
+
+
+def uuid_to_int(value):
+    """Convert an UUID string to a 128 bits integer, more compact than the string in a set."""
+    return int(value.replace("-", ""), 16)
+
+
+class UuidPool:
+    """
+    Generate UUID v4 as ready to write strings.
+
+    Random bytes are read by batches from os.urandom() and converted to hexadecimal
+    in one call, so each UUID only costs some string slicing.
+    """
+
+    def __init__(self, batch_size=4096):
+        self.batch_size = batch_size
+        self.pool = []
+
+    def fill(self):
+        hexa = os.urandom(16 * self.batch_size).hex()
+        self.pool = [
+            f"{hexa[i:i + 8]}-{hexa[i + 8:i + 12]}-4{hexa[i + 13:i + 16]}-"
+            f"{VARIANT_DIGITS[hexa[i + 16]]}{hexa[i + 17:i + 20]}-{hexa[i + 20:i + 32]}"
+            for i in range(0, len(hexa), 32)
+        ]
+
+    def get(self):
+        if not self.pool:
+            self.fill()
+        return self.pool.pop()
+
+
+class UuidGenerator:
+    """
+    Build UUIDs for rows where a UUID field is empty.
+
+    By default, UUID v4 are taken from a pool of random UUIDs.
+    If "uuid.deterministic" parameter is true, UUID v5 are built from the field name,
+    "code_source" and "entity_source_pk_value" values with "uuid.namespace" (or a default
+    namespace). A re-run on the same file will then produce the same UUIDs.
+    """
+
+    initialized = False
+    pool = UuidPool()
+    namespace = None
+    null_value_string = None
+
+    @classmethod
+    def _initialize(cls):
+        cls.initialized = True
+        cls.null_value_string = Config.get("null_value_string")
+        if Config.has("uuid.deterministic") and Config.get("uuid.deterministic"):
+            if Config.has("uuid.namespace"):
+                cls.namespace = uuid.UUID(Config.get("uuid.namespace"))
+            else:
+                cls.namespace = DEFAULT_NAMESPACE
+
+    @classmethod
+    def reset(cls):
+        cls.initialized = False
+        cls.namespace = None
+
+    @classmethod
+    def is_deterministic(cls):
+        if not cls.initialized:
+            cls._initialize()
+
+        return cls.namespace is not None
+
+    @classmethod
+    def generate(cls, row=None, field=None):
+        if not cls.initialized:
+            cls._initialize()
+
+        if cls.namespace is not None and row is not None:
+            source = row.get("code_source")
+            source_pk = row.get("entity_source_pk_value")
+            if source and source_pk and cls.null_value_string not in (source, source_pk):
+                return str(uuid.uuid5(cls.namespace, f"{field}:{source}:{source_pk}"))
+        return cls.pool.get()
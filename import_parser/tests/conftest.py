@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Modules of the parser are imported from the import_parser directory, like the runners do
+sys.path.insert(0, os.path.realpath(f"{os.path.dirname(os.path.abspath(__file__))}/../"))
+
+# Define default OS Environment variables needed by helpers modules
+import engine  # noqa: E402,F401
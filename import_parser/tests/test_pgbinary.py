@@ -0,0 +1,22 @@
+import datetime
+import struct
+
+from helpers.pgbinary import encode_bool, encode_timestamp, parse_timestamp, TypedValuesChecker
+
+
+def test_timestamp_offset_is_ignored():
+    expected = datetime.datetime(2021, 6, 1, 12, 30, 15, 123456)
+    for value in ["2021-06-01 12:30:15.1234567+02:00", "2021-06-01T12:30:15.123456Z"]:
+        assert parse_timestamp(value) == expected
+    assert encode_timestamp("2021-06-01 12:30:15-05") == encode_timestamp("2021-06-01 12:30:15")
+
+
+def test_bool_values():
+    for value in ["t", "TRUE", "1", "yes", "on"]:
+        assert encode_bool(value) == struct.pack("!i?", 1, True)
+    for value in ["f", "False", "0", "no", "off"]:
+        assert encode_bool(value) == struct.pack("!i?", 1, False)
+
+    checker = TypedValuesChecker({"flag": "bool", "comment": "text"})
+    assert checker.check("flag", "oui") == "invalid bool value"
+    assert checker.check("flag", "\\N") is None
@@ -0,0 +1,18 @@
+import io
+import csv
+
+from helpers.sort import get_sort_value, SortedWriter
+
+
+def test_sort_values_of_integers_and_strings():
+    values = ["10", "9", "b", None, "²", b"2", "a"]
+    assert sorted(values, key=get_sort_value) == [b"2", "9", "10", None, "a", "b", "²"]
+
+
+def test_sorted_writer_merges_runs():
+    f = io.StringIO()
+    writer = SortedWriter(csv.DictWriter(f, ["k"], lineterminator="\n"), ["k"], memory_limit=3)
+    writer.writeheader()
+    writer.writerows({"k": str(value)} for value in [5, 3, 8, 1, 9, 2, 7])
+    writer.close()
+    assert f.getvalue().split() == ["k", "1", "2", "3", "5", "7", "8", "9"]
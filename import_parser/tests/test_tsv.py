@@ -0,0 +1,48 @@
+import io
+import csv
+
+from helpers.tsv import MmapTsvReader, TsvWriter
+
+
+def read_rows(tmp_path, data, raw_fieldnames=()):
+    path = tmp_path / "source.tsv"
+    path.write_bytes(data)
+    with open(path, "rb") as f:
+        reader = MmapTsvReader(f)
+        reader.set_raw_fieldnames(raw_fieldnames)
+        rows = [(reader.line_num, row) for row in reader]
+        reader.close()
+    return rows
+
+
+def test_bare_carriage_return_is_kept_in_value(tmp_path):
+    rows = read_rows(tmp_path, b"a\tb\tc\n1\tx\ry\t3\n4\t5\t6\n", raw_fieldnames=["b"])
+    assert rows == [
+        (2, {"a": "1", "b": "x\ry", "c": "3"}),
+        (3, {"a": "4", "b": b"5", "c": "6"}),
+    ]
+
+
+def test_last_line_without_new_line(tmp_path):
+    rows = read_rows(tmp_path, b"a\tb\n1\t2\n3\tx\ry", raw_fieldnames=["a"])
+    assert rows == [(2, {"a": b"1", "b": "2"}), (3, {"a": "3", "b": "x\ry"})]
+
+
+def test_last_line_with_carriage_return_only(tmp_path):
+    rows = read_rows(tmp_path, b"a\tb\r\n1\t2\r\n3\t4\r")
+    assert rows == [(2, {"a": "1", "b": "2"}), (3, {"a": "3", "b": "4"})]
+
+
+def test_quoted_values_are_parsed_by_csv_module(tmp_path):
+    rows = read_rows(tmp_path, b'a\tb\n"1\t2"\t"x\ny"\n3\t4\n')
+    assert rows == [(3, {"a": "1\t2", "b": "x\ny"}), (4, {"a": "3", "b": "4"})]
+
+
+def test_writer_quotes_values_like_csv_writer():
+    rows = [{"a": "x\ry", "b": "raw"}, {"a": "x\ny", "b": 'q"q'}, {"a": "x\ty", "b": None}]
+    expected = io.StringIO()
+    csv.DictWriter(expected, ["a", "b"], delimiter="\t", lineterminator="\n").writerows(rows)
+
+    f = io.BytesIO()
+    TsvWriter(f, fieldnames=["a", "b"]).writerows([{**rows[0], "b": b"raw"}] + rows[1:])
+    assert f.getvalue().decode("utf-8") == expected.getvalue()
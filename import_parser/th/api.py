@@ -0,0 +1,86 @@
+from engine import Engine
+from helpers.config import Config
+from helpers.helpers import print_error
+from th.parser import (
+    check_attributes_headers,
+    replace_code_theme,
+    get_text_flip_plan,
+    flip_text_row,
+    check_taxon_code,
+    replace_taxon_code,
+)
+
+ACTIONS_TYPES = {
+    "th": "THEME",
+    "a": "ATTRIBUT",
+    "t": "TEXT",
+    "m": "MEDIA",
+}
+# Lookups (reference tables of the database) needed by each import type
+LOOKUPS = {
+    "a": ["themes"],
+    "t": ["attributes"],
+    "m": ["scinames_codes"],
+}
+TEXT_FIELDNAMES = ["cd_ref", "attribut_id", "text"]
+
+
+class Parser(Engine):
+    """
+    TaxHub plugin of the engine: transform rows of themes, attributes, texts and medias.
+
+    Lookups are the reference tables of the TaxHub database ("themes", "attributes" and
+    "scinames_codes", a TaxrefIndex). Rows of texts ("t" import type) are flipped to
+    tuples of TEXT_FIELDNAMES values, to write with a csv.writer.
+    """
+
+    actions_types = ACTIONS_TYPES
+    lookups_names = LOOKUPS
+
+    def connect_database(self):
+        # Avoid to import psycopg2 when all lookups are given
+        from th.db import ThDatabase
+
+        db = ThDatabase()
+        db.connect_to_database()
+        return db
+
+    def set_fieldnames(self, fieldnames):
+        super().set_fieldnames(fieldnames)
+        if self.import_type == "t":
+            # Attributes columns are flipped to lines with a plan computed once
+            check_attributes_headers(self.lookups["attributes"], fieldnames)
+            self.text_flip_plan = get_text_flip_plan(self.lookups["attributes"], self.fieldnames)
+            self.null_value = Config.get("null_value_string")
+            self.fieldnames = TEXT_FIELDNAMES
+        return self.fieldnames
+
+    def transform_attribute(self, row, reader, reasons):
+        # Replace Theme Code
+        row = replace_code_theme(row, self.lookups["themes"], reader)
+        return [row]
+
+    def transform_text(self, row, reader, reasons):
+        # Flip attribute from column to line
+        return flip_text_row(row, self.text_flip_plan, self.null_value)
+
+    def transform_media(self, row, reader, reasons):
+        # Check Taxon code (=cd_ref)
+        if check_taxon_code(row, self.lookups["scinames_codes"]) is False:
+            print_error(
+                f"Line {reader.line_num}: taxon code {row['cd_ref']} not exists ! Trying to find a cd_ref by using cd_nom in TaxRef !"
+            )
+            (exists, row) = replace_taxon_code(row, self.lookups["scinames_codes"])
+            if exists is False:
+                self.reports["lines_removed_total"] += 1
+                reasons.append(f"taxon or sciname code {row['cd_ref']} not exists in TaxRef")
+                print_error(
+                    f"Line {reader.line_num} removed ! Taxon or sciname code {row['cd_ref']} not exists in TaxRef !"
+                )
+        return [row]
+
+    stages = {
+        "a": transform_attribute,
+        "t": transform_text,
+        "m": transform_media,
+    }
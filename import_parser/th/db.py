@@ -2,6 +2,7 @@ import psycopg2
 import psycopg2.extras
 
 from helpers.config import Config
+from helpers.taxref import load_taxref_index
 
 
 class ThDatabase:
@@ -31,6 +32,10 @@ class ThDatabase:
         record = self.db_cursor.fetchone()
         print(f"You are connected to - {record}")
 
+    def close(self):
+        self.db_cursor.close()
+        self.db_connection.close()
+
     def get_all_themes(self):
         self.db_cursor.execute(
             """
@@ -41,7 +46,7 @@ class ThDatabase:
         records = self.db_cursor.fetchall()
         themes = {}
         for record in records:
-            themes[record["code"]] = record["id"]
+            themes[record["code"]] = str(record["id"])
         return themes
 
     def get_all_attributes(self):
@@ -54,31 +59,36 @@ class ThDatabase:
         records = self.db_cursor.fetchall()
         themes = {}
         for record in records:
-            themes[record["code"]] = record["id"]
+            themes[record["code"]] = str(record["id"])
         return themes
 
-    def get_all_taxons_codes(self):
+    def get_all_scinames_codes(self):
+        """Get the TaxRef index of scinames codes (cd_nom) and taxons codes (cd_ref)."""
+        return load_taxref_index(self)
+
+    def get_taxref_fingerprint(self):
+        """Get a value changing with the TaxRef version: number, maximum and sum of codes."""
         self.db_cursor.execute(
             """
-            SELECT DISTINCT cd_ref AS code, lb_nom AS name
+            SELECT
+                count(cd_nom) AS scinames_number,
+                max(cd_nom) AS max_cd_nom,
+                sum(cd_ref::bigint) AS cd_refs_sum
             FROM taxonomie.taxref
             """
         )
-        records = self.db_cursor.fetchall()
-        codes = {}
-        for record in records:
-            codes[str(record["code"])] = record["name"]
-        return codes
+        record = self.db_cursor.fetchone()
+        return f"{record['scinames_number']}-{record['max_cd_nom']}-{record['cd_refs_sum']}"
 
-    def get_all_scinames_codes(self):
-        self.db_cursor.execute(
+    def get_taxref_codes(self):
+        """Get (cd_nom, cd_ref) of all TaxRef scinames, streamed by a server side cursor."""
+        cursor = self.db_connection.cursor(name="taxref_codes")
+        cursor.itersize = 100000
+        cursor.execute(
             """
-            SELECT DISTINCT cd_nom AS sciname_code, cd_ref AS taxon_code
+            SELECT cd_nom, cd_ref
             FROM taxonomie.taxref
             """
         )
-        records = self.db_cursor.fetchall()
-        codes = {}
-        for record in records:
-            codes[str(record["sciname_code"])] = record["taxon_code"]
-        return codes
+        yield from cursor
+        cursor.close()
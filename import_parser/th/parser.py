@@ -35,32 +35,33 @@ def replace_code_theme(row, themes, reader):
     return row
 
 
-def flip_text_row(row, attributes):
-    new_rows = []
-    for fieldname in row.keys():
-        value = row[fieldname]
-        if not is_empty_or_null(value) and fieldname != "cd_ref":
-            new_rows.append(
-                {
-                    "cd_ref": row["cd_ref"],
-                    "attribut_id": attributes[fieldname],
-                    "text": value,
-                }
-            )
-    return new_rows
+def get_text_flip_plan(attributes, fieldnames):
+    """Get (fieldname, attribute id) pairs of columns checked by check_attributes_headers()."""
+    return [(fieldname, attributes[fieldname]) for fieldname in fieldnames if fieldname != "cd_ref"]
 
 
-def check_taxon_code(row, taxons_codes):
+def flip_text_row(row, plan, null_value):
+    # Tuples (cd_ref, attribut_id, text) are written by a csv.writer
+    cd_ref = row["cd_ref"]
+    return [
+        (cd_ref, attribute_id, row[fieldname])
+        for fieldname, attribute_id in plan
+        if row[fieldname] and row[fieldname] != null_value
+    ]
+
+
+def check_taxon_code(row, taxref_index):
     exists = False
     if row["cd_ref"] is not None and row["cd_ref"] != Config.get("null_value_string"):
-        exists = str(row["cd_ref"]) in taxons_codes.keys()
+        exists = taxref_index.has_cd_ref(row["cd_ref"])
     return exists
 
 
-def replace_taxon_code(row, scinames_codes):
+def replace_taxon_code(row, taxref_index):
     exists = False
     if row["cd_ref"] is not None and row["cd_ref"] != Config.get("null_value_string"):
-        exists = str(row["cd_ref"]) in scinames_codes.keys()
+        cd_ref = taxref_index.get_cd_ref(row["cd_ref"])
+        exists = cd_ref is not None
     if exists:
-        row["cd_ref"] = scinames_codes[row["cd_ref"]]
+        row["cd_ref"] = cd_ref
     return (exists, row)
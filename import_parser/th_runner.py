@@ -3,7 +3,9 @@ import sys
 import csv
 import time
 import datetime
-import json
+
+# Measure time spent to import modules, see startup_duration
+startup_time = time.time()
 
 import click
 
@@ -18,24 +20,13 @@ os.environ["IMPORT_PARSER.PATHES.SHARED.CONFIG"] = config_shared_dir
 os.environ["IMPORT_PARSER.PATHES.APP"] = app_dir
 os.environ["IMPORT_PARSER.PATHES.APP.CONFIG"] = config_dir
 
-from th.db import ThDatabase
-from helpers.config import Config
-from helpers.helpers import print_error
-from gn2.parser import (
-    remove_headers,
-    add_headers,
-    remove_columns,
-    add_columns,
-    insert_values_to_columns,
-    force_protected_char,
-)
-from th.parser import (
-    check_attributes_headers,
-    replace_code_theme,
-    flip_text_row,
-    check_taxon_code,
-    replace_taxon_code,
-)
+from helpers.structure import RecordedLines, StructureCheckedReader
+from helpers.progress import Progress
+from helpers.metrics import MetricsExporter
+from engine import get_dialects, print_actions_parameters, register_dialects, save_report
+from th.api import Parser
+
+startup_duration = time.time() - startup_time
 
 
 @click.command()
@@ -66,10 +57,45 @@ from th.parser import (
     "-r",
     "--report",
     "report_dir",
-    default=False,
+    default=None,
     help="Directory where the report file is stored.",
 )
-def parse_file(filename, import_type, actions_config_file, report_dir):
+@click.option(
+    "--check-fields/--no-check-fields",
+    "check_fields",
+    default=False,
+    help="Move lines with a number of fields different from the header, or unreadable, "
+    "in a file suffixed by '_malformed' instead of stopping.",
+)
+@click.option(
+    "--progress-interval",
+    "progress_interval",
+    type=float,
+    default=30.0,
+    help="Seconds between two progress lines when the output is not a terminal.",
+)
+@click.option(
+    "--status-file",
+    "status_file",
+    default=None,
+    help="JSON file updated with the progress of the parsing (rows, rows/s, ETA...).",
+)
+@click.option(
+    "--metrics",
+    "metrics_file",
+    default=None,
+    help="OpenMetrics textfile, for node_exporter textfile collector, updated during the run.",
+)
+def parse_file(
+    filename,
+    import_type,
+    actions_config_file,
+    report_dir,
+    check_fields,
+    progress_interval,
+    status_file,
+    metrics_file,
+):
     """
     TaxHub Import Parser
 
@@ -91,173 +117,108 @@ def parse_file(filename, import_type, actions_config_file, report_dir):
 
     filename_src = click.format_filename(filename)
     filename_dest = os.path.splitext(filename_src)[0] + "_rti.csv"
+    filename_malformed = os.path.splitext(filename_src)[0] + "_malformed.csv"
 
-    set_actions_type(import_type)
-    load_actions_config_file(actions_config_file)
+    metrics = MetricsExporter(
+        metrics_file,
+        {"runner": "th", "type": import_type},
+        info={"file": os.path.basename(filename_src)},
+    )
+    metrics.stages["startup"] = startup_duration
+    metrics.start_stage("configuration")
+    parser = Parser(import_type, actions_config_file)
+    metrics.reports = parser.reports
+    metrics.lookups = parser.lookups_durations
 
-    reader_dialect = Config.get("csv.reader.dialect") if Config.has("csv.reader.dialect") else "tsv"
-    writer_dialect = Config.get("csv.writer.dialect") if Config.has("csv.writer.dialect") else "tsv"
+    reader_dialect, writer_dialect = get_dialects()
 
     click.echo("Source filename:" + filename_src)
     click.echo("Destination filename:" + filename_dest)
     click.echo("Type:" + import_type)
-    click.echo("Remove columns ? " + str(Config.get("actions.remove_columns")))
-    click.echo("Columns to remove: " + ", ".join(Config.get("actions.remove_columns.params")))
-    click.echo("Add columns ? " + str(Config.get("actions.add_columns")))
-    click.echo(
-        "Columns to add: "
-        + json.dumps(
-            Config.get("actions.add_columns.params"), indent=4, sort_keys=True, default=str
-        )
-    )
-    click.echo("Set columns values ? " + str(Config.get("actions.set_values")))
-    click.echo(
-        "Columns to set values: "
-        + json.dumps(Config.get("actions.set_values.params"), indent=4, sort_keys=True, default=str)
-    )
-    click.echo(f"CSV Reader dialect: {reader_dialect}")
-    click.echo(f"CSV Writer dialect: {writer_dialect}")
+    click.echo(f"Startup time: {startup_duration:.3f}s")
+    print_actions_parameters()
+    click.echo(f"Check number of fields ? {check_fields}")
 
-    csv.register_dialect(
-        "ssv",
-        delimiter=";",
-        quotechar='"',
-        doublequote=True,
-        quoting=csv.QUOTE_ALL,
-        lineterminator="\r\n",
-    )
-    csv.register_dialect(
-        "ssv-minimal",
-        delimiter=";",
-        quotechar='"',
-        doublequote=True,
-        quoting=csv.QUOTE_MINIMAL,
-        lineterminator="\n",
-    )
-    csv.register_dialect(
-        "tsv",
-        delimiter="\t",
-        quotechar='"',
-        doublequote=True,
-        quoting=csv.QUOTE_MINIMAL,
-        lineterminator="\n",
-    )
+    register_dialects()
 
     # Access to the database if necessary
     db_access_need = set(["a", "t", "m"])
     if import_type in db_access_need:
-        db = ThDatabase()
-        db.connect_to_database()
+        metrics.start_stage("database")
+        db = parser.connect_database()
         # Show database infos
         db.print_database_infos()
 
-    # If necessary, get infos in the database
-    if import_type == "a":
-        themes = db.get_all_themes()
-    elif import_type == "t":
-        attributes = db.get_all_attributes()
-    elif import_type == "m":
-        taxons_codes = db.get_all_taxons_codes()
-        scinames_codes = db.get_all_scinames_codes()
+        # Get infos in the database
+        parser.load_lookups(db)
+        db.close()
 
     # Open CSV files
+    metrics.start_stage("parsing")
+    metrics.write()
     with open(filename_src, "r", newline="", encoding="utf-8") as f_src:
-        reader = csv.DictReader(f_src, dialect=reader_dialect)
+        total_bytes = os.path.getsize(filename_src)
+        # Lines of records are kept to write malformed ones as read
+        records = RecordedLines(f_src) if check_fields else f_src
+        reader = csv.DictReader(records, dialect=reader_dialect)
         with open(filename_dest, "w", newline="", encoding="utf-8") as f_dest:
+            fieldnames = parser.set_fieldnames(reader.fieldnames)
             if import_type == "t":
-                check_attributes_headers(attributes, reader.fieldnames)
-                output_fieldnames = ["cd_ref", "attribut_id", "text"]
-                writer = csv.DictWriter(
-                    f_dest, dialect=writer_dialect, fieldnames=output_fieldnames
-                )
-                writer.writeheader()
+                # Flipped texts are tuples
+                writer = csv.writer(f_dest, dialect=writer_dialect)
+                writer.writerow(fieldnames)
             else:
-                fieldnames = remove_headers(reader.fieldnames)
-                fieldnames = add_headers(fieldnames)
                 writer = csv.DictWriter(f_dest, dialect=writer_dialect, fieldnames=fieldnames)
                 writer.writeheader()
 
-            try:
-                for row in reader:
-                    # TODO: check if number of fields is egal to number of columns,
-                    # else there is a tab in fields value !
-
-                    # Remove useless columns
-                    row = remove_columns(row, reader)
-
-                    # Add new columns if necessary
-                    row = add_columns(row)
-
-                    # Insert value in colums
-                    row = insert_values_to_columns(row)
-
-                    # Maintain protected char
-                    row = force_protected_char(row)
-
-                    if import_type == "a":
-                        # Replace Theme Code
-                        row = replace_code_theme(row, themes, reader)
-                        # Write in destination file
-                        writer.writerow(row)
-                    elif import_type == "t":
-                        # Flip attribute from column to line
-                        for new_row in flip_text_row(row, attributes):
-                            # Write in destination file
-                            writer.writerow(new_row)
-                    elif import_type == "m":
-                        # Check Taxon code (=cd_ref)
-                        if check_taxon_code(row, taxons_codes) is False:
-                            print_error(
-                                f"Line {reader.line_num}: taxon code {row['cd_ref']} not exists ! Trying to find a cd_ref by using cd_nom in TaxRef !"
-                            )
-                            (exists, row) = replace_taxon_code(row, scinames_codes)
-                            if exists is False:
-                                print_error(
-                                    f"Line {reader.line_num} removed ! Taxon or sciname code {row['cd_ref']} not exists in TaxRef !"
-                                )
-                            else:
-                                writer.writerow(row)
-                        else:
-                            writer.writerow(row)
-                    else:
-                        writer.writerow(row)
-            except csv.Error as e:
-                sys.exit(f"Error in file {filename}, line {reader.line_num}: {e}")
+            if check_fields:
+                reader = StructureCheckedReader(reader, records, filename_malformed, writer_dialect)
+
+            with Progress(
+                None,
+                total_bytes=total_bytes,
+                get_position=f_src.buffer.tell,
+                interval=progress_interval,
+                status_file=status_file,
+                on_update=lambda: metrics.update(
+                    parser.rows_number, parser.removed_rows_number, parser.written_rows_number
+                ),
+            ) as progress:
+                try:
+                    parser.run(reader, writer, progress=progress)
+                except csv.Error as e:
+                    sys.exit(f"Error in file {filename}, line {reader.line_num}: {e}")
+
+            metrics.start_stage("finalization")
+            metrics.set_rows(
+                parser.rows_number, parser.removed_rows_number, parser.written_rows_number
+            )
+            if check_fields:
+                reader.close_malformed_file()
+                malformed_rows_number = len(reader.malformed_lines)
+                click.echo(f"Malformed lines removed: {malformed_rows_number}")
+                parser.reports["fields_checked"] = True
+                parser.reports["malformed_lines"] = reader.malformed_lines
+                parser.reports["lines_removed_total"] += malformed_rows_number
+                metrics.rows_read += malformed_rows_number
+                metrics.rows_rejected += malformed_rows_number
+
+    metrics.end_stage()
+    metrics.write(finished=True)
 
     # Script time elapsed
     time_elapsed = time.time() - start_time
     time_elapsed_for_human = str(datetime.timedelta(seconds=time_elapsed))
     print(f"Script time elapsed: {time_elapsed_for_human}")
 
+    # Build and print report
+    report_output = parser.render_report(time_elapsed_for_human)
+    if report_output is not None:
+        print(report_output)
 
-def set_actions_type(abbr_type):
-    types = {
-        "th": "THEME",
-        "a": "ATTRIBUT",
-        "t": "TEXT",
-        "m": "MEDIA",
-    }
-    if abbr_type in types:
-        Config.setParameter("actions.type", types[abbr_type])
-    else:
-        print_error(f'Type "{abbr_type}" is not implemented !')
-        exit()
-
-
-def load_actions_config_file(actions_config_file):
-    if actions_config_file != "" and os.path.exists(actions_config_file):
-        print(f"Actions config file: {actions_config_file}")
-        Config.load(actions_config_file)
-        define_current_actions()
-    else:
-        print_error(f'Actions config file "${actions_config_file}" not exists !')
-
-
-def define_current_actions():
-    actions_type = Config.get("actions.type")
-    parameters = Config.getSection(actions_type)
-    for key, value in parameters.items():
-        Config.setParameter(key, value)
+        # Save the report
+        if report_dir:
+            save_report(report_output, report_dir)
 
 
 if __name__ == "__main__":